@@ -0,0 +1,220 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import morse
+from config import MORSE, TIMING_RATIOS
+from util import bin_to_freq, get_bin_size
+
+# Searches the stft, threshold and band settings for the ones that decode best. Every worker renders one stft and
+# solves all threshold/band variants on it, the workers run in parallel and the search stops at a time budget.
+
+WINDOW_SECONDS = (0.006, 0.012, 0.023, 0.046)  # about 256 to 2048 samples at 44.1 kHz
+HOP_DIVISORS = (2, 4)
+THRESHOLDS_DB = (None, -50, -40, -30, -20, -10)  # None: no threshold filter
+REFINE_DB = 5
+MAX_BANDS = 3
+GRACE = 1.0  # seconds past the budget that running jobs get to hand in their results
+
+
+# ------------------------------------------------------ Scoring ----------------------------------------------------- #
+
+def score(code, stats):
+    # share of valid letters, times how close the timings are to 1:3 and 1:3:7 and how tightly the durations gather
+    # around them, times a factor that keeps a couple of lucky letters from beating a long transcript. in [0, 1)
+    letters = code.replace('/', ' ').split()
+    if not letters or 'dash_frames' not in stats or 'word_spacing_frames' not in stats:
+        return 0.0
+    valid = sum(letter in MORSE for letter in letters) / len(letters)
+    # ratios of durations in frames, the timings in seconds carry the offset of frames_to_time
+    dot, symbol_spacing = stats['dot_frames'], stats['symbol_spacing_frames']
+    if dot <= 0 or symbol_spacing <= 0:
+        return 0.0
+    observed = np.array([stats['dash_frames'] / dot, stats['letter_spacing_frames'] / symbol_spacing,
+                         stats['word_spacing_frames'] / symbol_spacing])
+    expected = np.array([TIMING_RATIOS[1], TIMING_RATIOS[1], TIMING_RATIOS[2]]) / TIMING_RATIOS[0]
+    timing = float(np.exp(-np.mean(np.abs(np.log(np.maximum(observed, 1e-3) / expected))) - stats['timing_spread']))
+    return valid * timing * len(letters) / (len(letters) + 3)
+
+
+# ------------------------------------------------------ Search ------------------------------------------------------ #
+
+def stft_grid(sr, values):
+    # the given settings first, then every window length and hop, closest window to the given one first
+    given = (int(values['n_fft']), int(values['win_length']), int(values['hop_length']))
+    grid = [given]
+    for seconds in WINDOW_SECONDS:
+        win_length = 1 << max(4, int(round(np.log2(seconds * sr))))
+        for divisor in HOP_DIVISORS:
+            settings = (2 * win_length, win_length, win_length // divisor)
+            if settings not in grid:
+                grid.append(settings)
+    return grid[:1] + sorted(grid[1:], key=lambda s: (abs(np.log2(s[1] / given[1])), s[1] // s[2]))
+
+
+def evaluate_stft(y, sr, values, settings, carriers, deadline):
+    # renders one stft and solves every threshold/band variant on it until the deadline, at least the first one so a
+    # short budget still gives a result. returns a list of results
+    n_fft, win_length, hop_length = settings
+    stft_values = dict(values, n_fft=str(n_fft), win_length=str(win_length), hop_length=str(hop_length))
+    dft = morse.get_dft(y, sr, stft_values)
+
+    # bands around the estimated carrier and the strongest peaks of this spectrogram
+    bin_size = get_bin_size(sr, stft_values)
+    centers = list(carriers) + [bin_to_freq(i, sr, stft_values) for i in morse.find_carriers(dft)[:MAX_BANDS]]
+    bands = [None]
+    for freq in centers:
+        band = morse.carrier_band(freq, sr, stft_values)
+        if all(other is None or abs(other[0] - band[0]) > bin_size for other in bands):
+            bands.append(band)
+
+    results = []
+
+    def run(band, threshold):
+        candidate = dict(stft_values, apply_threshold_db=threshold is not None,
+                         threshold_db=values['threshold_db'] if threshold is None else str(threshold),
+                         apply_freq_band=band is not None,
+                         freq_band_min='' if band is None else f"{band[0]:.1f}",
+                         freq_band_max='' if band is None else f"{band[1]:.1f}")
+        pipeline = morse.FilterPipeline(dft, sr, stft_values)
+        pipeline.apply(candidate)
+        stats = {}
+        carrier = None if band is None else (band[0] + band[1]) / 2
+        code, status = pipeline.solve(candidate, carrier, stats)
+        results.append({'score': score(code, stats), 'values': candidate, 'code': code, 'status': status})
+        return results[-1]['score']
+
+    for band in bands:
+        best_score, best_threshold = -1.0, None
+        for threshold in THRESHOLDS_DB:
+            if results and time.time() > deadline:
+                return results
+            value = run(band, threshold)
+            if value > best_score:
+                best_score, best_threshold = value, threshold
+        # adaptive step: look between the best threshold and its neighbours
+        if best_threshold is not None:
+            for threshold in (best_threshold - REFINE_DB, best_threshold + REFINE_DB):
+                if time.time() > deadline:
+                    return results
+                if threshold < 0:
+                    run(band, threshold)
+    return results
+
+
+_worker_signal = None
+
+
+def _init_worker(y, sr):
+    # the signal is handed to every worker once, not with every job
+    global _worker_signal
+    _worker_signal = (y, sr)
+
+
+def _evaluate_job(args):
+    y, sr = _worker_signal
+    return evaluate_stft(y, sr, *args)
+
+
+def sweep(y, sr, values, budget=30.0, processes=None, progress=None):
+    # returns the best result, {'score', 'values', 'code', 'text', 'status'}, and all results best first. values are
+    # complete, in the form of config.DEFAULTS, so they can go straight to the GUI or batch.py -p.
+    # progress: optional callable taking the fraction of the stft settings done
+    deadline = time.time() + budget
+    carrier, _ = morse.estimate_carrier(y, sr, values)
+    jobs = [(values, settings, [carrier], deadline) for settings in stft_grid(sr, values)]
+    processes = os.cpu_count() if processes is None else processes
+
+    results = []
+    done = 0
+
+    def collect(found):
+        nonlocal done
+        results.extend(found)
+        done += 1
+        if progress is not None:
+            progress(done / len(jobs))
+
+    def finished(future, timeout=None):
+        # a job that failed or is still busy after the timeout is skipped, the others keep their results
+        try:
+            return future.result(timeout)
+        except Exception:
+            return []
+
+    if processes > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(min(processes, len(jobs)), initializer=_init_worker,
+                                                          initargs=(y, sr))
+        futures = [executor.submit(_evaluate_job, job) for job in jobs]
+        pending = set(futures)
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=max(0.0, deadline - time.time())):
+                pending.discard(future)
+                collect(finished(future))
+        except concurrent.futures.TimeoutError:
+            # queued jobs are dropped, running ones stop at their next variant and hand in what they have. one still
+            # in its stft is not waited for beyond the grace period
+            for future in pending:
+                future.cancel()
+            for future in pending:
+                if not future.cancelled():
+                    collect(finished(future, max(0.0, deadline + GRACE - time.time())))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        for job in jobs:
+            if results and time.time() > deadline:
+                break
+            try:
+                collect(evaluate_stft(y, sr, *job))
+            except Exception:
+                collect([])
+
+    results.sort(key=lambda result: result['score'], reverse=True)
+    for result in results:
+        result['text'] = morse.decode(result['code']).strip()
+    return (results[0] if results else None), results
+
+
+# ------------------------------------------------------ Driver ------------------------------------------------------ #
+
+def main(argv=None):
+    from batch import parse_values
+
+    parser = argparse.ArgumentParser(description='Find the stft, threshold and band settings that decode a file best.')
+    parser.add_argument('filename', help='WAV file')
+    parser.add_argument('-b', '--budget', type=float, default=30.0, help='time budget in seconds')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-p', '--params', help='JSON file with the starting parameter values')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a single starting parameter')
+    parser.add_argument('-n', '--top', type=int, default=5, help='number of candidates listed on stderr')
+    parser.add_argument('-o', '--output', help='write the best values as JSON, usable with batch.py -p')
+    args = parser.parse_args(argv)
+
+    y, sr = morse.load_file(args.filename)
+    start = time.perf_counter()
+    best, results = sweep(y, sr, parse_values(args.params, args.set), args.budget, args.jobs)
+    print(f"{len(results)} candidates in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    for result in results[:args.top]:
+        v = result['values']
+        print(f"{result['score']:.3f}  n_fft={v['n_fft']} win={v['win_length']} hop={v['hop_length']} "
+              f"threshold={v['threshold_db'] if v['apply_threshold_db'] else '-'} "
+              f"band={v['freq_band_min']}-{v['freq_band_max'] if v['apply_freq_band'] else ''}  {result['text'][:40]}",
+              file=sys.stderr)
+    if best is None:
+        return 1
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(best['values'], f, indent=2)
+    print(json.dumps({key: best[key] for key in ('score', 'values', 'code', 'text', 'status')}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import morse
+import profiling
+from config import DEFAULTS
+
+CHUNKED_BYTES = 1 << 30  # larger files get a memory-mapped spectrogram
+
+
+# ------------------------------------------------- Helper Functions ------------------------------------------------- #
+
+def find_files(patterns):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(sorted(glob.glob(os.path.join(pattern, '**', '*.wav'), recursive=True)))
+        else:
+            files.extend(sorted(glob.glob(pattern, recursive=True)))
+    return files
+
+
+def parse_values(params_file, overrides):
+    # values take the same form as DEFAULTS (and as the GUI hands them over): strings, and booleans for the flags
+    values = dict(DEFAULTS)
+    if params_file is not None:
+        with open(params_file) as f:
+            values.update(json.load(f))
+    for override in overrides:
+        key, _, value = override.partition('=')
+        if key not in DEFAULTS:
+            raise SystemExit(f"Unknown parameter: {key}")
+        if isinstance(DEFAULTS[key], bool):
+            value = value.lower() in ('1', 'true', 'yes', 'on')
+        values[key] = value
+    return values
+
+
+def process_file(args):
+    filename, values, carrier, auto_band, trace, stft_jobs, segment_silence, timestamps, baseband, chunked = args
+    if not trace:
+        return decode_file(filename, values, carrier, auto_band, stft_jobs, segment_silence, timestamps, baseband,
+                           chunked)
+    # each worker records its own stages, the records go back to the parent with the result
+    tracer = profiling.start(profiling.Tracer(file=filename))
+    try:
+        result = decode_file(filename, values, carrier, auto_band, stft_jobs, segment_silence, timestamps, baseband,
+                           chunked)
+    finally:
+        profiling.stop()
+    result['trace'] = tracer.records
+    return result
+
+
+def decode_file(filename, values, carrier, auto_band=False, stft_jobs=1, segment_silence=None, timestamps=False,
+                baseband=False, chunked=None):
+    try:
+        if chunked is None:
+            chunked = os.path.getsize(filename) > CHUNKED_BYTES
+        if chunked and carrier is None and not baseband:
+            # recordings that do not fit in memory, see decode_chunked
+            return decode_chunked(filename, values, auto_band, segment_silence, timestamps)
+        y, sr = morse.load_file(filename)
+        if baseband:
+            # the carrier band shifted down and decimated, frequencies and times stay those of the file
+            y, sr, values = morse.to_baseband(y, sr, values)
+        if carrier is None:
+            found = None
+            if auto_band:
+                # band filter around the estimated carrier, which solve then takes as the dominant frequency
+                found, _ = morse.estimate_carrier(y, sr, values)
+                band_min, band_max = morse.carrier_band(found, sr, values)
+                values = dict(values, apply_freq_band=True, freq_band_min=str(band_min), freq_band_max=str(band_max))
+            dft = morse.get_dft(y, sr, values, processes=stft_jobs)
+            dft = morse.tweak_dft(dft, sr, values)
+            if segment_silence is not None:
+                # every transmission with its own timing, listed with its start and end
+                code, status, segments = morse.solve_segments(dft, sr, values, carrier=found,
+                                                              min_silence=segment_silence, processes=stft_jobs)
+                return {'file': filename, 'ok': True, 'code': code, 'text': morse.decode(code).strip(),
+                        'status': status, 'segments': segments}
+            if timestamps:
+                # every character with its start and end in seconds
+                keying, status = morse.solve(dft, sr, values, carrier=found, events=True)
+                return {'file': filename, 'ok': True, 'code': keying.code, 'text': keying.text.strip(),
+                        'status': status, 'transcript': keying.transcript.tolist()}
+            code, status = morse.solve(dft, sr, values, carrier=found)
+        else:
+            # envelope of a single carrier, no spectrogram needed
+            code, status = morse.solve_carrier(y, sr, values, None if carrier == 'auto' else float(carrier))
+        return {'file': filename, 'ok': True, 'code': code, 'text': morse.decode(code).strip(), 'status': status}
+    except Exception as e:
+        # a file that fails to decode is reported, the pool keeps going
+        return {'file': filename, 'ok': False, 'code': '', 'text': '', 'status': f"{type(e).__name__}: {e}"}
+
+
+def decode_chunked(filename, values, auto_band=False, segment_silence=None, timestamps=False):
+    # the file stays memory-mapped and the spectrogram is computed block by block into a memory-mapped temporary
+    # file. the filters are then applied to the band region only, which is all that is read back into memory
+    y, sr = morse.load_file_mmap(filename)
+    found = None
+    if auto_band:
+        found, _ = morse.estimate_carrier(y, sr, values, peaks=morse.get_peaks(y))
+        band_min, band_max = morse.carrier_band(found, sr, values)
+        values = dict(values, apply_freq_band=True, freq_band_min=str(band_min), freq_band_max=str(band_max))
+    shape = (int(values['n_fft']) // 2 + 1, morse.get_frame_count(len(y), values))
+    del y
+    with tempfile.TemporaryDirectory() as directory:
+        out = np.memmap(os.path.join(directory, 'dft.f32'), dtype=np.float32, mode='w+', shape=shape)
+        dft, _ = morse.get_dft_chunked(filename, values, out=out)
+        pipeline = morse.FilterPipeline(dft, sr, values)
+        pipeline.apply(values)
+        if segment_silence is not None:
+            code, status, segments = pipeline.solve_segments(values, found, min_silence=segment_silence)
+            text, extra = morse.decode(code).strip(), {'segments': segments}
+        elif timestamps:
+            keying, status = pipeline.solve(values, found, events=True)
+            code, text, extra = keying.code, keying.text.strip(), {'transcript': keying.transcript.tolist()}
+        else:
+            code, status = pipeline.solve(values, found)
+            text, extra = morse.decode(code).strip(), {}
+        # the mapping has to be closed before the temporary file can be removed on windows
+        del pipeline, dft, out
+    return {'file': filename, 'ok': True, 'code': code, 'text': text, 'status': status, **extra}
+
+
+# ------------------------------------------------------ Driver ------------------------------------------------------ #
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode morse code from WAV files without the GUI.')
+    parser.add_argument('paths', nargs='+', help='WAV files, directories or glob patterns')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-p', '--params', help='JSON file with parameter values in the form of config.DEFAULTS')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a single parameter, e.g. -s hop_length=128 -s apply_threshold_db=true')
+    parser.add_argument('-c', '--carrier', metavar='HZ|auto',
+                        help='decode only the envelope of this carrier frequency (or the estimated one), '
+                             'skipping the spectrogram and the filters')
+    parser.add_argument('-b', '--auto-band', action='store_true',
+                        help='filter a band around the estimated carrier frequency before solving')
+    parser.add_argument('-f', '--format', choices=('json', 'csv'), default='json', help='output format')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('-t', '--trace', metavar='FILE',
+                        help='write the time, memory and intermediate counts of every stage as JSON lines')
+    parser.add_argument('-J', '--stft-jobs', type=int, default=1,
+                        help='decode the files one at a time, splitting each spectrogram between this many processes '
+                             '(for a few long recordings)')
+    parser.add_argument('-g', '--segment-silence', type=float, metavar='SECONDS',
+                        help='split the recording at silences this long and solve every transmission with its own '
+                             'timing, e.g. 3 for operators at different speeds taking turns')
+    parser.add_argument('-T', '--timestamps', action='store_true',
+                        help='list every decoded character with its start and end time')
+    parser.add_argument('-C', '--chunked', action='store_true', default=None,
+                        help='keep the recording and its spectrogram out of memory, computed block by block into a '
+                             f'temporary file (the default for files over {CHUNKED_BYTES >> 30} GiB, not with -c or -B)')
+    parser.add_argument('-B', '--baseband', action='store_true',
+                        help='shift the applied band (or the estimated carrier) down and decimate before decoding, '
+                             'faster on long recordings at high sample rates')
+    args = parser.parse_args(argv)
+
+    values = parse_values(args.params, args.set)
+    files = find_files(args.paths)
+    out = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    fields = ('file', 'ok', 'code', 'text', 'status')
+    if args.format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+
+    # the core imports scipy lazily, load it once here so forked workers inherit it instead of importing it each
+    import scipy.io.wavfile  # noqa: F401
+    import scipy.signal  # noqa: F401
+
+    trace_out = None if args.trace is None else open(args.trace, 'w')
+    tracer = None if trace_out is None else profiling.Tracer(trace_out, memory=False)
+
+    start = time.perf_counter()
+    failed = 0
+    try:
+        jobs = ((f, values, args.carrier, args.auto_band, tracer is not None, args.stft_jobs, args.segment_silence,
+                 args.timestamps, args.baseband, args.chunked) for f in files)
+        # pool workers can not start processes of their own, so split spectrograms are computed from here
+        pool = multiprocessing.Pool(max(1, args.jobs)) if args.stft_jobs <= 1 else None
+        with pool or contextlib.nullcontext():
+            results = map(process_file, jobs) if pool is None else pool.imap_unordered(process_file, jobs)
+            for result in results:
+                failed += not result['ok']
+                for record in result.pop('trace', []):
+                    tracer.add(record)
+                if args.format == 'csv':
+                    writer.writerow(result)
+                else:
+                    out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if trace_out is not None:
+            trace_out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = len(files) / elapsed if elapsed > 0 else 0.0
+    print(f"{len(files)} files ({failed} failed) in {elapsed:.2f} s, {rate:.2f} files/s", file=sys.stderr)
+    if tracer is not None:
+        print(tracer.format_summary(counts=False), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
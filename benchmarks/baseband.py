@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+from synthetic import character_error_rate, random_text, synthesize  # noqa: E402
+
+
+# a long recording at a high sample rate: the spectrogram of the whole band against the baseband front end, which
+# shifts the carrier band down and decimates before the spectrogram
+
+def run(name, y, sr, values, reference):
+    start = time.perf_counter()
+    dft = morse.tweak_dft(morse.get_dft(y, sr, values), sr, values)
+    stft = time.perf_counter() - start
+    start = time.perf_counter()
+    code, _ = morse.solve(dft, sr, values)
+    solve = time.perf_counter() - start
+    print(f"{name:<10}{sr:>8}{1000 * stft:>12.1f}{1000 * solve:>12.1f}"
+          f"{character_error_rate(morse.decode(code), reference):>8.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=float, default=10.0)
+    parser.add_argument('--sr', type=int, default=44100)
+    parser.add_argument('--wpm', type=int, default=20)
+    parser.add_argument('--snr', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    text = random_text(rng, 60 * args.minutes, args.wpm)
+    y = synthesize([text], [800.0], args.wpm, 0.05, args.snr, 0.0, args.sr, rng)
+    y /= np.max(np.abs(y))
+    values = dict(DEFAULTS, apply_freq_band=True, freq_band_min='600', freq_band_max='1000')
+
+    print(f"{len(y) / args.sr / 60:.1f} min at {args.sr} Hz")
+    print(f"{'':<10}{'sr':>8}{'stft (ms)':>12}{'solve (ms)':>12}{'CER':>8}")
+    run('full', y, args.sr, values, text)
+    start = time.perf_counter()
+    baseband, sr, baseband_values = morse.to_baseband(y, args.sr, values)
+    print(f"{'front end':<10}{sr:>8}{1000 * (time.perf_counter() - start):>12.1f}")
+    run('baseband', baseband, sr, baseband_values, text)
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import TIMING_RATIOS  # noqa: E402
+from morse import cluster_1d  # noqa: E402
+
+
+# compares cluster_1d with the sklearn KMeans that solve used before, on durations with known classes.
+# sklearn is only needed for this comparison: pip install scikit-learn
+
+def make_durations(rng, n, k, unit=8.0, jitter=0.15):
+    truth = rng.randint(0, k, size=n)
+    durations = np.round(unit * np.asarray(TIMING_RATIOS)[truth] * (1 + jitter * rng.randn(n))).clip(1)
+    return durations, truth
+
+
+def kmeans(x, k):
+    import sklearn.cluster
+    fit = sklearn.cluster.KMeans(k).fit(x.reshape(-1, 1))
+    order = np.argsort(np.argsort(fit.cluster_centers_.flatten()))
+    return order[fit.labels_]
+
+
+def run(name, classify, durations, truth):
+    start = time.perf_counter()
+    labels = classify(durations)
+    elapsed = time.perf_counter() - start
+    return name, elapsed, np.mean(labels == truth)
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    print(f"{'method':<16}{'k':>3}{'n':>9}{'jitter':>8}{'time (ms)':>12}{'accuracy':>10}")
+    for k in (2, 3):
+        for n in (100, 10000, 1000000):
+            for jitter in (0.1, 0.3):
+                durations, truth = make_durations(rng, n, k, jitter=jitter)
+                methods = [('cluster_1d', lambda x: cluster_1d(x, k)[1]),
+                           ('cluster_1d+ratio', lambda x: cluster_1d(x, k, TIMING_RATIOS)[1]),
+                           ('KMeans', lambda x: kmeans(x, k))]
+                for name, classify in methods:
+                    name, elapsed, accuracy = run(name, classify, durations, truth)
+                    print(f"{name:<16}{k:>3}{n:>9}{jitter:>8.2f}{1000 * elapsed:>12.2f}{accuracy:>10.4f}")
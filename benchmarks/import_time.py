@@ -0,0 +1,36 @@
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules of the decoding core, and what they must not pull in at import time
+CORE_MODULES = ('morse', 'util', 'config', 'streaming', 'batch')
+HEAVY_MODULES = ('scipy.signal', 'scipy.io', 'sklearn', 'matplotlib', 'PySimpleGUI', 'tkinter')
+
+
+def measure(module):
+    # fresh interpreter per module, so nothing is cached between measurements
+    code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start); print(' '.join(sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    elapsed, modules = output.splitlines()
+    return float(elapsed), set(modules.split())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of the decoding core.')
+    parser.add_argument('--budget', type=float, default=0.25, help='maximum import time in seconds per module')
+    parser.add_argument('--repeat', type=int, default=3, help='best of this many runs')
+    args = parser.parse_args()
+
+    failed = False
+    for module in CORE_MODULES:
+        runs = [measure(module) for _ in range(args.repeat)]
+        elapsed = min(t for t, _ in runs)
+        heavy = [h for h in HEAVY_MODULES if any(m == h or m.startswith(h + '.') for m in runs[0][1])]
+        ok = elapsed <= args.budget and not heavy
+        failed |= not ok
+        print(f"{module:<12}{1000 * elapsed:>8.1f} ms  {'ok' if ok else 'FAIL'}  {' '.join(heavy)}")
+    sys.exit(1 if failed else 0)
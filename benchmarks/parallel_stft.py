@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+
+
+# get_dft on a long synthetic recording, sequential and split between 2, 4, ... processes, checking that every split
+# gives the same bytes
+
+def make_signal(rng, seconds, sr):
+    t = np.arange(int(seconds * sr)) / sr
+    keying = np.repeat(rng.rand(int(seconds * 20)) > 0.5, sr // 20)[:len(t)]
+    keying = np.pad(keying, (0, len(t) - len(keying)))
+    return (0.5 * keying * np.sin(2 * np.pi * 700 * t) + 0.1 * rng.randn(len(t))).astype(np.float32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--minutes', type=float, default=10.0, help='length of the recording')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='largest number of processes')
+    args = parser.parse_args()
+
+    sr = 44100
+    y = make_signal(np.random.RandomState(0), 60 * args.minutes, sr)
+    import scipy.signal  # noqa: F401
+
+    start = time.perf_counter()
+    expected = morse.get_dft(y, sr, DEFAULTS)
+    reference = time.perf_counter() - start
+    print(f"{args.minutes:g} min, {expected.nbytes / 1e6:.0f} MB spectrogram")
+    print(f"{'processes':>9}{'time (s)':>10}{'speed-up':>10}{'same':>6}")
+    print(f"{1:>9}{reference:>10.2f}{1.0:>10.2f}{'-':>6}")
+    processes = 2
+    while processes <= max(2, args.jobs):
+        start = time.perf_counter()
+        dft = morse.get_dft(y, sr, DEFAULTS, processes=processes)
+        elapsed = time.perf_counter() - start
+        same = dft.tobytes() == expected.tobytes()
+        print(f"{processes:>9}{elapsed:>10.2f}{reference / elapsed:>10.2f}{str(same):>6}")
+        del dft
+        processes *= 2
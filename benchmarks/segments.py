@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+from synthetic import character_error_rate, random_text, synthesize  # noqa: E402
+
+
+# operators at different speeds taking turns, with a few seconds of silence between them: one timing model for the
+# whole recording (solve) against one per transmission (solve_segments)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--wpm', type=int, nargs='+', default=[12, 35, 18, 40, 10, 28], help='speed of every turn')
+    parser.add_argument('--turn', type=float, default=20.0, help='seconds per turn')
+    parser.add_argument('--repeat', type=int, default=1, help='repeat the turns this many times')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes of solve_segments')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    sr = 8000
+    parts, texts = [], []
+    for wpm in args.wpm * args.repeat:
+        texts.append(random_text(rng, args.turn, wpm))
+        parts.append(synthesize([texts[-1]], [700.0], wpm, 0.05, 20.0, 0.0, sr, rng, lead=2.5))
+    y = np.concatenate(parts)
+    y /= np.max(np.abs(y))
+    reference = ' '.join(texts)
+
+    values = dict(DEFAULTS, apply_freq_band=True, freq_band_min='550', freq_band_max='850')
+    for key in ('n_fft', 'win_length', 'hop_length'):
+        values[key] = str(max(1, round(int(DEFAULTS[key]) * sr / 44100)))
+    pipeline = morse.FilterPipeline(morse.get_dft(y, sr, values), sr, values)
+    pipeline.apply(values)
+
+    print(f"{len(texts)} turns, {len(y) / sr / 60:.1f} min")
+    print(f"{'':<16}{'time (ms)':>10}{'CER':>8}")
+    start = time.perf_counter()
+    code, _ = pipeline.solve(values)
+    elapsed = time.perf_counter() - start
+    print(f"{'solve':<16}{1000 * elapsed:>10.1f}{character_error_rate(morse.decode(code), reference):>8.3f}")
+    start = time.perf_counter()
+    code, _, segments = pipeline.solve_segments(values, processes=args.jobs)
+    elapsed = time.perf_counter() - start
+    print(f"{'solve_segments':<16}{1000 * elapsed:>10.1f}{character_error_rate(morse.decode(code), reference):>8.3f}"
+          f"  ({len(segments)} transmissions)")
@@ -0,0 +1,173 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import codec  # noqa: E402
+import morse  # noqa: E402
+from config import DEFAULTS, MORSE  # noqa: E402
+
+# Generates morse audio from text with the MORSE table, runs it through load_file, get_dft, tweak_dft, solve and
+# decode, and writes one JSON line per scenario with the time and peak memory of every stage, the throughput
+# (audio seconds decoded per CPU second) and the character error rate against the source text.
+
+ALPHABET = [letter for letter in MORSE.values() if letter.isalnum()]
+
+PRESETS = {
+    # every combination of the listed values is run
+    'quick': {
+        'wpm': [15, 30], 'jitter': [0.0, 0.1], 'freq': [700.0], 'snr': [20.0, 0.0], 'fading': [0.0],
+        'carriers': [1], 'duration': [20.0], 'sr': [8000],
+    },
+    'full': {
+        'wpm': [10, 20, 35], 'jitter': [0.0, 0.1, 0.2], 'freq': [500.0, 1000.0], 'snr': [30.0, 10.0, 0.0, -5.0],
+        'fading': [0.0, 0.5], 'carriers': [1, 3], 'duration': [10.0, 60.0], 'sr': [44100],
+    },
+    'long': {
+        'wpm': [20], 'jitter': [0.1], 'freq': [800.0], 'snr': [10.0], 'fading': [0.3],
+        'carriers': [1], 'duration': [600.0, 3600.0], 'sr': [8000],
+    },
+}
+
+
+# ------------------------------------------------- Signal Synthesis ------------------------------------------------- #
+
+def random_text(rng, duration, wpm):
+    # about enough words to fill the duration, PARIS being the standard 50 unit word
+    n_words = max(1, int(np.ceil(duration * wpm / 60)))
+    return ' '.join(''.join(rng.choice(ALPHABET, size=rng.randint(2, 7))) for _ in range(n_words))
+
+
+def keying(text, wpm, jitter, rng):
+    # on/off levels and their durations in seconds, one pair per element
+    symbol_labels, spacing_labels = codec.encode_symbols(text)
+    units = np.empty(2 * len(symbol_labels) - 1)
+    units[0::2] = np.where(symbol_labels == codec.DASH, 3, 1)
+    units[1::2] = np.array([1, 3, 7])[spacing_labels]
+    levels = np.arange(len(units)) % 2 == 0
+    durations = units * (1.2 / wpm) * np.clip(1 + jitter * rng.randn(len(units)), 0.3, None)
+    return levels.astype(int), durations
+
+
+def synthesize(texts, freqs, wpm, jitter, snr, fading, sr, rng, lead=0.5):
+    # one keyed carrier per text, the first one the strongest. snr is the first carrier's power over the noise in a
+    # 500 Hz band, fading a slow amplitude modulation depth
+    signals = []
+    for i, (text, freq) in enumerate(zip(texts, freqs)):
+        levels, durations = keying(text, wpm * (1 + 0.25 * i), jitter, rng)
+        counts = np.round(durations * sr).astype(int)
+        envelope = np.concatenate((np.zeros(int(lead * sr)), np.repeat(levels, counts), np.zeros(int(lead * sr))))
+        # soften the keying edges with a 5 ms raised cosine to avoid clicks
+        ramp = np.hanning(max(3, int(0.005 * sr)))
+        envelope = np.convolve(envelope, ramp / ramp.sum(), mode='same')
+        t = np.arange(len(envelope)) / sr
+        amplitude = 10 ** (-6 * i / 20)
+        if fading > 0:
+            amplitude = amplitude * (1 - fading / 2 + fading / 2 * np.cos(2 * np.pi * rng.uniform(0.05, 0.3) * t))
+        signals.append(amplitude * envelope * np.sin(2 * np.pi * freq * t + rng.uniform(0, 2 * np.pi)))
+
+    y = np.zeros(max(len(s) for s in signals))
+    for s in signals:
+        y[:len(s)] += s
+    noise_power = 0.5 / 10 ** (snr / 10) * (sr / 2) / 500
+    y += np.sqrt(noise_power) * rng.randn(len(y))
+    return y
+
+
+def write_wav(filename, y, sr):
+    import scipy.io.wavfile
+    scipy.io.wavfile.write(filename, sr, (y / np.max(np.abs(y)) * 32767).astype(np.int16))
+
+
+# ----------------------------------------------------- Scoring ----------------------------------------------------- #
+
+def character_error_rate(decoded, reference):
+    decoded = ' '.join(decoded.split())
+    reference = ' '.join(reference.split())
+    previous = np.arange(len(decoded) + 1)
+    for i, r in enumerate(reference, 1):
+        current = np.empty_like(previous)
+        current[0] = i
+        for j, d in enumerate(decoded, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != d))
+        previous = current
+    return previous[-1] / max(1, len(reference))
+
+
+def timed(stages, name, func, *args):
+    tracemalloc.start()
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    stages[name] = {'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu,
+                    'peak_bytes': tracemalloc.get_traced_memory()[1]}
+    tracemalloc.stop()
+    return result
+
+
+def run_scenario(scenario, seed, directory):
+    rng = np.random.RandomState(seed)
+    sr = scenario['sr']
+    freqs = [scenario['freq'] * (1 + 0.6 * i) for i in range(scenario['carriers'])]
+    texts = [random_text(rng, scenario['duration'], scenario['wpm']) for _ in freqs]
+    y = synthesize(texts, freqs, scenario['wpm'], scenario['jitter'], scenario['snr'], scenario['fading'], sr, rng)
+    filename = os.path.join(directory, 'synthetic.wav')
+    write_wav(filename, y, sr)
+
+    # only the strongest carrier is scored, with a band filter around it. stft sizes are scaled with the sample rate so
+    # a frame spans the same time as DEFAULTS do at 44.1 kHz
+    values = dict(DEFAULTS, apply_freq_band=True, freq_band_min=str(freqs[0] - 150), freq_band_max=str(freqs[0] + 150))
+    for key in ('n_fft', 'win_length', 'hop_length'):
+        values[key] = str(max(1, round(int(DEFAULTS[key]) * sr / 44100)))
+    stages = {}
+    result = {'scenario': scenario, 'seed': seed, 'audio_seconds': len(y) / sr}
+    try:
+        y, sr = timed(stages, 'load_file', morse.load_file, filename)
+        dft = timed(stages, 'get_dft', morse.get_dft, y, sr, values)
+        dft = timed(stages, 'tweak_dft', morse.tweak_dft, dft, sr, values)
+        code, status = timed(stages, 'solve', morse.solve, dft, sr, values)
+        text = timed(stages, 'decode', morse.decode, code)
+        result.update(status=status, cer=character_error_rate(text, texts[0]), error=None)
+    except Exception as e:
+        # a failure has no error rate, a bad decode can score above 1 and must not look worse than it
+        result.update(status='', cer=None, error=f"{type(e).__name__}: {e}")
+    cpu = sum(stage['cpu'] for stage in stages.values())
+    result.update(stages=stages, cpu_seconds=cpu, throughput=result['audio_seconds'] / cpu if cpu > 0 else None,
+                  peak_bytes=max((stage['peak_bytes'] for stage in stages.values()), default=0))
+    return result
+
+
+# ------------------------------------------------------ Driver ------------------------------------------------------ #
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic speed and accuracy benchmark of the decoding pipeline.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='bench_results.jsonl', help='JSON lines file, appended to')
+    args = parser.parse_args()
+
+    # the core imports scipy lazily, load it here so the first scenario is not charged for it
+    import scipy.signal  # noqa: F401
+
+    grid = PRESETS[args.preset]
+    scenarios = [dict(zip(grid, combination)) for combination in itertools.product(*grid.values())]
+    machine = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+               'cpus': os.cpu_count()}
+    with tempfile.TemporaryDirectory() as directory, open(args.output, 'a') as out:
+        for i, scenario in enumerate(scenarios):
+            result = run_scenario(scenario, args.seed + i, directory)
+            result.update(preset=args.preset, machine=machine, timestamp=time.time())
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            throughput = 'n/a' if result['throughput'] is None else f"{result['throughput']:.1f}x"
+            cer = f"failed ({result['error']})" if result['cer'] is None else f"{result['cer']:.3f}"
+            print(f"[{i + 1}/{len(scenarios)}] {scenario}  cer={cer}  throughput={throughput}  "
+                  f"peak={result['peak_bytes'] / 1e6:.1f} MB")
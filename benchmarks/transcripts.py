@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import codec  # noqa: E402
+import morse  # noqa: E402
+from config import DEFAULTS, MORSE  # noqa: E402
+
+
+# compares the table-driven codec with morse.decode on one long transcript, on many short ones, and on the symbol
+# labels solve clusters into
+
+def make_code(rng, n_letters):
+    letters = rng.choice(list(MORSE), size=n_letters)
+    separators = rng.choice([' ', ' ', ' ', '/'], size=n_letters)
+    separators[-1] = ''
+    return ''.join(np.char.add(letters, separators))
+
+
+def run(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    print(f"{'case':<28}{'morse.decode (ms)':>18}{'codec (ms)':>12}{'same':>6}")
+    for n_letters in (100, 10000, 1000000):
+        code = make_code(rng, n_letters)
+        expected, reference = run(morse.decode, code)
+        text, elapsed = run(codec.decode, code)
+        print(f"{f'1 x {n_letters} letters':<28}{1000 * reference:>18.2f}{1000 * elapsed:>12.2f}{str(text == expected):>6}")
+
+        symbol_labels, spacing_labels = codec.encode_symbols(expected)
+        text, elapsed = run(codec.decode_symbols, symbol_labels, spacing_labels)
+        print(f"{f'  symbols':<28}{'':>18}{1000 * elapsed:>12.2f}{str(text == expected):>6}")
+
+        # the keying events solve returns with events=True, at 4 frames per unit
+        units = np.concatenate((np.where(symbol_labels == codec.DASH, 3, 1)[:, None],
+                                np.append(np.array([1, 3, 7])[spacing_labels], 0)[:, None]), axis=1).ravel()
+        edges = np.concatenate(([0], np.cumsum(4 * units)))
+        keying = morse.Keying.from_labels(edges[0:-2:2], edges[1::2], symbol_labels, spacing_labels, 44100, DEFAULTS)
+        transcript, elapsed = run(lambda: keying.transcript)
+        print(f"{f'  keying transcript':<28}{'':>18}{1000 * elapsed:>12.2f}"
+              f"{str(''.join(transcript['char']) == expected.strip()):>6}")
+
+    for n_transcripts in (1000, 100000):
+        transcripts = [make_code(rng, rng.randint(5, 60)) for _ in range(n_transcripts)]
+        expected, reference = run(lambda: [morse.decode(code) for code in transcripts])
+        texts, elapsed = run(codec.decode_many, transcripts)
+        print(f"{f'{n_transcripts} x 5-60 letters':<28}{1000 * reference:>18.2f}{1000 * elapsed:>12.2f}"
+              f"{str(texts == expected):>6}")
@@ -0,0 +1,118 @@
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+import morse
+from util import get_base_freq
+
+
+def hash_file(filename, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SpectrogramCache:
+    # get_dft results keyed by (file hash, sample rate, n_fft, win_length, hop_length, base frequency, quantized). the
+    # most recently used ones are kept in memory up to max_bytes; evicted ones are written to `directory` (if given)
+    # and memory-mapped back into memory when they are used again.
+
+    def __init__(self, max_bytes=512 * 1024 ** 2, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_hash, sr, values, quantize=False):
+        return (file_hash, int(sr), int(values['n_fft']), int(values['win_length']), int(values['hop_length']),
+                get_base_freq(values), bool(quantize))
+
+    def get_dft(self, y, sr, values, file_hash, **kwargs):
+        # kwargs go to morse.get_dft on a miss, an int8 spectrogram is kept apart from the float32 one
+        key = self.make_key(file_hash, sr, values, kwargs.get('quantize', False))
+        dft = self.get(key)
+        if dft is None:
+            self.misses += 1
+            dft = morse.get_dft(y, sr, values, **kwargs)
+            self.put(key, dft)
+        return dft
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def put(self, key, dft):
+        with self._lock:
+            self._put(key, dft)
+
+    def _get(self, key):
+        if key in self._items:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            self.disk_hits += 1
+            dft = np.load(path, mmap_mode='r')
+            self._put(key, dft)
+            return dft
+        return None
+
+    def _put(self, key, dft):
+        # cached arrays are shared between callers, so they are read-only
+        dft.flags.writeable = False
+        if key in self._items:
+            self._bytes -= self._items.pop(key).nbytes
+        self._items[key] = dft
+        self._bytes += dft.nbytes
+        while self._bytes > self.max_bytes and len(self._items) > 1:
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions,
+                'items': len(self._items), 'bytes': self._bytes}
+
+    def flush(self):
+        # write the spectrograms held in memory to the directory as well, so they outlive the process
+        with self._lock:
+            for key, dft in self._items.items():
+                self._write(key, dft)
+
+    def _evict(self):
+        key, dft = self._items.popitem(last=False)
+        self._bytes -= dft.nbytes
+        self.evictions += 1
+        self._write(key, dft)
+
+    def _write(self, key, dft):
+        path = self._path(key)
+        if path is not None and not os.path.exists(path):
+            # write next to the target and rename, so a half written file is never loaded. processes sharing the
+            # directory each write their own temporary file
+            tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, dft)
+            os.replace(tmp_path, path)
+
+    def _path(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, '_'.join(str(k) for k in key) + '.npy')
@@ -0,0 +1,170 @@
+import numpy as np
+
+from config import MORSE
+
+# Every letter is packed into one integer: a leading 1 bit that marks the length, followed by one bit per symbol, dot
+# being 0 and dash 1, first symbol first. e.g. '.-' is 0b101 and '-..' is 0b1100. Zero is never a valid letter and is
+# used for anything that is not in MORSE.
+MAX_LENGTH = max(len(code) for code in MORSE)
+UNKNOWN = '¿'
+DOT, DASH = 0, 1
+SYMBOL_SPACING, LETTER_SPACING, WORD_SPACING = 0, 1, 2  # same labels as the spacing clusters of solve
+
+
+def pack(code):
+    packed = 1
+    for symbol in code:
+        packed = packed << 1 | (symbol == '-')
+    return packed
+
+
+# packed letter -> character, packed letter -> number of symbols, and character code point -> packed letter
+LETTERS = np.full(2 << MAX_LENGTH, UNKNOWN, dtype='U1')
+LENGTHS = np.zeros(2 << MAX_LENGTH, dtype=np.int64)
+for _code, _letter in MORSE.items():
+    LETTERS[pack(_code)] = _letter
+    LENGTHS[pack(_code)] = len(_code)
+CODES = np.zeros(max(ord(letter) for letter in MORSE.values()) + 1, dtype=np.int64)
+for _code, _letter in MORSE.items():
+    CODES[ord(_letter)] = pack(_code)
+del _code, _letter
+
+
+def _join(chars):
+    # one string out of a 'U1' array without going through a python list
+    return str(chars.view(f"U{len(chars)}")[0]) if len(chars) else ''
+
+
+# ----------------------------------------------------- Decoding ----------------------------------------------------- #
+
+def decode(encoded):
+    # same output as splitting on '/' and ' ' and looking every letter up in MORSE: a space after every word and
+    # UNKNOWN for every letter that is not in the table, including empty ones
+    code = encoded.strip()
+    if code == '':
+        return ''
+    return _join(_spell(*_read_letters(code)))
+
+
+def decode_many(transcripts):
+    # decode() of every transcript, all of them read in one pass so the numpy overhead is paid once
+    codes = [encoded.strip() for encoded in transcripts]
+    present = [code for code in codes if code]
+    if not present:
+        return ['' for _ in codes]
+    text = _join(_spell(*_read_letters('/'.join(present))))
+    # every transcript takes a character for each letter and a space for each word
+    sizes = [code.count(' ') + 2 * code.count('/') + 2 for code in present]
+    ends = np.cumsum(sizes).tolist()
+    decoded = iter(text[end - size:end] for size, end in zip(sizes, ends))
+    return [next(decoded) if code else '' for code in codes]
+
+
+def _read_letters(code):
+    # returns the letters of a code string and whether each of them closes a word.
+    # non-ascii characters become '?', which is just as invalid. every letter ends at a separator, one is appended
+    # for the last one, and is read through a window of MAX_LENGTH bytes, padded at the end
+    chars = np.frombuffer(code.encode('ascii', 'replace') + b'/' + b'?' * MAX_LENGTH, dtype=np.uint8)
+    sep_idx = np.flatnonzero((chars == ord(' ')) | (chars == ord('/')))
+    letter_start = np.concatenate(([0], sep_idx[:-1] + 1))
+    length = sep_idx - letter_start
+
+    # pack one symbol column at a time. letters with other characters than dots and dashes, or too long for the
+    # table, are unknown
+    packed = np.ones(len(letter_start), dtype=np.int64)
+    invalid = length > MAX_LENGTH
+    for i in range(MAX_LENGTH):
+        symbol = chars[letter_start + i]
+        inside = i < length
+        invalid |= inside & (symbol != ord('.')) & (symbol != ord('-'))
+        packed = np.where(inside, packed << 1 | (symbol == ord('-')), packed)
+    packed[invalid] = 0
+
+    # a letter is the last of its word if a '/' or the end follows it
+    return LETTERS[packed], chars[sep_idx] == ord('/')
+
+
+def decode_packed(packed, word_end):
+    # packed: letters as packed integers, word_end: whether each one closes a word
+    packed = np.asarray(packed, dtype=np.int64)
+    packed = np.where((packed > 0) & (packed < len(LETTERS)), packed, 0)
+    return _join(_spell(LETTERS[packed], np.asarray(word_end, dtype=bool)))
+
+
+def decode_symbols(symbol_labels, spacing_labels):
+    # decode the labels solve clusters the marks and the gaps into, without building the code string
+    # symbol_labels: DOT or DASH for every mark, spacing_labels: spacing label for every gap between two marks
+    return decode_packed(*pack_symbols(symbol_labels, spacing_labels))
+
+
+def pack_symbols(symbol_labels, spacing_labels):
+    # returns the packed letters and whether each of them closes a word
+    symbol_labels = np.asarray(symbol_labels, dtype=np.int64)
+    spacing_labels = np.asarray(spacing_labels, dtype=np.int64)
+    if len(symbol_labels) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    breaks = np.flatnonzero(spacing_labels != SYMBOL_SPACING) + 1
+    letter_start = np.concatenate(([0], breaks))
+    length = np.diff(np.concatenate((letter_start, [len(symbol_labels)])))
+
+    # pack one symbol column at a time, the same way as code strings are read
+    dashes = np.concatenate((symbol_labels == DASH, np.zeros(MAX_LENGTH, dtype=bool)))
+    packed = np.ones(len(letter_start), dtype=np.int64)
+    for i in range(MAX_LENGTH):
+        packed = np.where(i < length, packed << 1 | dashes[letter_start + i], packed)
+    packed[length > MAX_LENGTH] = 0
+
+    word_end = np.ones(len(letter_start), dtype=bool)
+    word_end[:-1] = spacing_labels[breaks - 1] == WORD_SPACING
+    return packed, word_end
+
+
+def _spell(letters, word_end):
+    # letters followed by a space at every word end
+    out = np.full(len(letters) + np.count_nonzero(word_end), ' ', dtype='U1')
+    out[np.arange(len(letters)) + np.cumsum(word_end) - word_end] = letters
+    return out
+
+
+# ----------------------------------------------------- Encoding ----------------------------------------------------- #
+
+def encode_symbols(text):
+    # text -> (symbol_labels, spacing_labels), the inverse of decode_symbols. characters that are not in MORSE are
+    # left out, whitespace separates words
+    chars = np.frombuffer(text.upper().encode('utf-32-le'), dtype=np.uint32)
+    is_space = np.isin(chars, [ord(c) for c in ' \t\r\n'])
+    packed = CODES[np.where(chars < len(CODES), chars, 0)]
+    # a word starts at every letter that has a space since the previous letter
+    spaces_before = np.cumsum(is_space)[packed > 0]
+    packed = packed[packed > 0]
+    if len(packed) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    word_start = np.diff(spaces_before, prepend=spaces_before[0]) > 0
+
+    length = LENGTHS[packed]
+    letter_idx = np.repeat(np.arange(len(packed)), length)
+    letter_start = np.cumsum(length) - length
+    position = np.arange(len(letter_idx)) - letter_start[letter_idx]
+    symbol_labels = packed[letter_idx] >> (length[letter_idx] - 1 - position) & 1
+
+    spacing_labels = np.full(len(symbol_labels), SYMBOL_SPACING, dtype=np.int64)
+    spacing_labels[letter_start] = np.where(word_start, WORD_SPACING, LETTER_SPACING)
+    return symbol_labels, spacing_labels[1:]
+
+
+def encode_code(symbol_labels, spacing_labels):
+    # labels -> code string of the form solve returns, '.' and '-' with ' ' between letters and '/' between words
+    symbol_labels = np.asarray(symbol_labels)
+    spacing_labels = np.asarray(spacing_labels)
+    if len(symbol_labels) == 0:
+        return ''
+    gap = spacing_labels != SYMBOL_SPACING
+    out = np.empty(len(symbol_labels) + np.count_nonzero(gap), dtype='U1')
+    symbol_pos = np.arange(len(symbol_labels)) + np.concatenate(([0], np.cumsum(gap)))
+    out[symbol_pos] = np.where(symbol_labels == DASH, '-', '.')
+    out[symbol_pos[1:][gap] - 1] = np.where(spacing_labels[gap] == WORD_SPACING, '/', ' ')
+    return _join(out)
+
+
+def encode(text):
+    return encode_code(*encode_symbols(text))
@@ -27,12 +27,17 @@ DEFAULTS = {
     'plot_freq_min': '',
     'plot_freq_max': '',
     'plot_grids': False,
+    'fixed_ratios': False,
     'dot_length': '',
     'dash_length': '',
     'letter_spacing': '',
-    'word_spacing': ''
+    'word_spacing': '',
+    'base_freq': '0'
 }
 
+# dot : dash and symbol : letter : word spacing
+TIMING_RATIOS = (1, 3, 7)
+
 MORSE = {
     "-----": "0",
     ".----": "1",
@@ -8,17 +8,21 @@ from config import ABOUT_TEXT, DEFAULTS
 
 # ---------------------------------------------------- Theme Setup --------------------------------------------------- #
 
-sg.theme("DarkBlue")
-plt.style.use('dark_background')
-plt.rcParams['figure.facecolor'] = "#1a2835"
-plt.rcParams['figure.figsize'] = (11, 5.5)
-plt.rcParams['font.family'] = 'sans'
-plt.rcParams['font.size'] = 10.0
 SMALLFONT = ("Helvitica", 10)
 APPFONT = ('Helvitica', 12)
 MONOSPACEFONT = ('Consolas', 12)
 
 
+def setup_theme():
+    # global PySimpleGUI/matplotlib state, applied by the GUI entry point rather than on import
+    sg.theme("DarkBlue")
+    plt.style.use('dark_background')
+    plt.rcParams['figure.facecolor'] = "#1a2835"
+    plt.rcParams['figure.figsize'] = (11, 5.5)
+    plt.rcParams['font.family'] = 'sans'
+    plt.rcParams['font.size'] = 10.0
+
+
 # -------------------------------------------------------------------------------------------------------------------- #
 
 def create_window(filename):
@@ -32,6 +36,10 @@ def show_about():
     sg.popup_ok(ABOUT_TEXT, title='About', icon='info', keep_on_top=True, grab_anywhere=True, font=APPFONT)
 
 
+def show_profile(summary):
+    sg.popup_scrolled(summary, title='Profile', size=(110, 25), font=MONOSPACEFONT, keep_on_top=True)
+
+
 def get_filename():
     # Get the filename from the user
     filename = sg.popup_get_file('Choose an audio file', keep_on_top=True, grab_anywhere=True, location=(0, 0),
@@ -103,7 +111,13 @@ def generate_layout(filename):
                 sg.T('Hop length:',  expand_x=True),
                 sg.Input(k='hop_length', s=15, justification="end", default_text=DEFAULTS['hop_length'])
             ],
-            [sg.Button('Render', k='-RENDER-', s=10)]
+            [
+                sg.Button('Render', k='-RENDER-', s=10),
+                sg.CB('Baseband', k='-BASEBAND-', enable_events=True,
+                      tooltip='Shift the carrier band down and decimate, so long files render and solve faster'),
+                # set by the baseband front end, frequencies are shown relative to the original file
+                sg.Input(k='base_freq', visible=False, default_text=DEFAULTS['base_freq'])
+            ]
         ])],
 
         # ----------------------------------------- Audio Filtering Settings ----------------------------------------- #
@@ -116,7 +130,8 @@ def generate_layout(filename):
                 sg.CB('Frequency band (Hz):',  expand_x=True, default=DEFAULTS['apply_freq_band'], k='apply_freq_band'),
                 sg.Input(k='freq_band_min', s=10, justification="end", default_text=DEFAULTS['freq_band_min']),
                 sg.T('-'),
-                sg.Input(k='freq_band_max', s=10, justification="end", default_text=DEFAULTS['freq_band_max'])
+                sg.Input(k='freq_band_max', s=10, justification="end", default_text=DEFAULTS['freq_band_max']),
+                sg.Button('Auto', k='-FIND-CARRIER-', font=SMALLFONT, tooltip='Center the band on the estimated carrier')
             ],
             [
                 sg.CB('Time band (s):',  expand_x=True, default=DEFAULTS['apply_time_band'], k='apply_time_band'),
@@ -124,12 +139,17 @@ def generate_layout(filename):
                 sg.T('-'),
                 sg.Input(k='time_band_max', s=10, justification="end", default_text=DEFAULTS['time_band_max'])
             ],
-            [sg.Button('Apply', k='-APPLY-', s=10)]
+            [sg.Button('Apply', k='-APPLY-', s=10), sg.Button('Undo', k='-UNDO-', s=10)]
         ])],
 
         # ------------------------------------------- Morse Decode Display ------------------------------------------- #
         [sg.Frame(title='Decoding', pad=((5, 5), (0, 10)), expand_x=True, element_justification='center', layout=[
-            [sg.Button('Solve', k='-SOLVE-', s=10)],
+            [sg.CB('Assume 1:3:7 timing', default=DEFAULTS['fixed_ratios'], k='fixed_ratios')],
+            [
+                sg.Button('Solve', k='-SOLVE-', s=10),
+                sg.Button('Auto-tune', k='-AUTOTUNE-', s=10,
+                          tooltip='Search the sampling, threshold and band settings that decode best')
+            ],
             [sg.Multiline(s=(40, 5), k='-ENCODED-', font=MONOSPACEFONT)],
             [sg.Button('Decode', k='-DECODE-', s=10)],
             [sg.Multiline(s=(40, 4), k='-DECODED-', font=MONOSPACEFONT)]
@@ -140,11 +160,17 @@ def generate_layout(filename):
     #                                                      LAYOUT                                                      #
     # ================================================================================================================ #
     layout = [
-        [sg.Menu([['&Help', ['&About::-ABOUT-']]], tearoff=False)],
+        [sg.Menu([['&View', ['&Profile summary::-PROFILE-SUMMARY-']], ['&Help', ['&About::-ABOUT-']]], tearoff=False)],
         [
             sg.Column(output_layout, vertical_alignment='top', expand_y=True),
             sg.Column(input_layout, vertical_alignment='top', expand_y=True)
         ],
-        [sg.StatusBar('Ready', k='-STATUS-', p=0, size=180, font=SMALLFONT)]
+        [
+            sg.StatusBar('Ready', k='-STATUS-', p=0, size=150, font=SMALLFONT),
+            sg.ProgressBar(100, orientation='h', s=(20, 12), k='-PROGRESS-'),
+            sg.Button('Cancel', k='-CANCEL-', font=SMALLFONT),
+            sg.CB('Profile', k='-PROFILE-', enable_events=True, font=SMALLFONT,
+                  tooltip='Record the time and memory of every stage, see View > Profile summary')
+        ]
     ]
     return layout
@@ -1,13 +1,16 @@
+import threading
 import traceback
 
-import matplotlib.pyplot as plt
 import PySimpleGUI as sg
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+import autotune
 import morse
+import profiling
+from cache import SpectrogramCache, hash_file
 from config import DEFAULTS
-from gui import create_window, get_filename, show_about
-from plotting import plot
+from gui import create_window, get_filename, setup_theme, show_about, show_profile
+from plotting import SpectrogramRenderer
 from util import bin_to_freq, frames_to_time, get_bin_size
 
 
@@ -20,13 +23,106 @@ def draw_figure(canvas, figure):
     return figure_canvas_agg
 
 
-def setup_interactions(figure, dft, sr, values, window):
+def setup_interactions(renderer, window):
+    # reads whatever the renderer drew last, the sample rate changes with the baseband front end
     def notify_mouse_move(event):
-        if event.xdata is not None and event.ydata is not None and int(event.ydata) < dft.shape[0]:
-            coords = f"{frames_to_time(event.xdata, sr, values):.4f} s  {bin_to_freq(int(event.ydata), sr, values):.2f} Hz"
+        if event.xdata is None or event.ydata is None or renderer.pipeline is None:
+            return
+        pipeline, sr, values = renderer.pipeline, renderer.sr, renderer.values
+        freq_bin, frame = int(round(event.ydata)), int(round(event.xdata))
+        if 0 <= freq_bin < pipeline.shape[0] and 0 <= frame < pipeline.shape[1]:
+            coords = f"{frames_to_time(event.xdata, sr, values):.4f} s  {bin_to_freq(freq_bin, sr, values):.2f} Hz"
             window['-COORDS-'].update(coords)
-            window['-VALUE-'].update(f"{dft[int(event.ydata)][int(event.xdata)]:.2f} dB")
-    figure.canvas.mpl_connect('motion_notify_event', notify_mouse_move)
+            window['-VALUE-'].update(f"{pipeline.value_at(freq_bin, frame):.2f} dB")
+    renderer.fig.canvas.mpl_connect('motion_notify_event', notify_mouse_move)
+
+
+# ------------------------------------------------ Background Tasks ------------------------------------------------ #
+
+RENDER_BLOCK_FRAMES = 4096
+AUTOTUNE_BUDGET = 20.0  # seconds
+# the settings the baseband front end changes, restored when it is turned off
+BASEBAND_KEYS = ('n_fft', 'win_length', 'hop_length', 'base_freq')
+# the settings an auto-tune fills in
+TUNED_KEYS = ('n_fft', 'win_length', 'hop_length', 'apply_threshold_db', 'threshold_db', 'apply_freq_band',
+              'freq_band_min', 'freq_band_max')
+
+
+class Cancelled(Exception):
+    pass
+
+
+class TaskRunner:
+    # runs Render/Plot/Solve work on worker threads and hands the results back to the event loop as events. a new task
+    # replaces the one in flight of the same kind: the old one stops at its next progress report and its result is
+    # dropped. tasks of other kinds keep running, except that render and plot both draw the figure and replace each
+    # other.
+
+    def __init__(self, window):
+        self.window = window
+        self.generations = {}
+
+    @staticmethod
+    def channel(kind):
+        return 'render' if kind == 'plot' else kind
+
+    def submit(self, kind, func, *args):
+        channel = self.channel(kind)
+        self.generations[channel] = generation = self.generations.get(channel, 0) + 1
+
+        def progress(fraction):
+            if not self.is_current(kind, generation):
+                raise Cancelled()
+            self.window.write_event_value('-TASK-PROGRESS-', (generation, kind, fraction))
+
+        def run():
+            try:
+                result = func(progress, *args)
+                progress(1.0)
+            except Cancelled:
+                return
+            except Exception:
+                self.window.write_event_value('-TASK-ERROR-', (generation, kind, traceback.format_exc()))
+            else:
+                self.window.write_event_value('-TASK-DONE-', (generation, kind, result))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def cancel(self, kind=None):
+        # the tasks of one kind, all of them by default
+        for channel in self.generations if kind is None else [self.channel(kind)]:
+            self.generations[channel] = self.generations.get(channel, 0) + 1
+
+    def is_current(self, kind, generation):
+        return generation == self.generations.get(self.channel(kind))
+
+
+def render_task(progress, y, sr, values, cache, file_hash, renderer):
+    # transformed here block by block, for the progress bar. no worker processes: forking from a thread of the GUI is
+    # not safe
+    dft = cache.get_dft(y, sr, values, file_hash, block_frames=RENDER_BLOCK_FRAMES, progress=progress, processes=1)
+    pipeline = morse.FilterPipeline(dft, sr, values)
+    return pipeline, renderer.prepare(pipeline, sr, values)
+
+
+def plot_task(progress, pipeline, sr, values, renderer):
+    return pipeline, renderer.prepare(pipeline, sr, values)
+
+
+def solve_task(progress, pipeline, values, carrier):
+    progress(0.0)
+    return pipeline.solve(values, carrier)
+
+
+def autotune_task(progress, y, sr, values):
+    progress(0.0)
+    # serial, as in render_task: no worker processes forked from a thread of the GUI
+    return autotune.sweep(y, sr, values, AUTOTUNE_BUDGET, processes=1, progress=progress)
+
+
+def baseband_task(progress, y, sr, values):
+    progress(0.0)
+    return morse.to_baseband(y, sr, values)
 
 
 # ---------------------------------------------------- Event Loop ---------------------------------------------------- #
@@ -36,46 +132,151 @@ def event_loop(window):
         # Load the audio file
         y, sr = morse.load_file(filename)
         window['-SR-'].update(f"{sr} Hz")
-        dft = morse.get_dft(y, sr, DEFAULTS)
+        # the file as loaded and its sampling settings, kept while the baseband signal is shown
+        y_full, sr_full, full_values = y, sr, None
+        # spectrograms of settings already rendered are reused
+        cache = SpectrogramCache()
+        file_hash = hash_file(filename)
+        # filters are kept apart from the spectrogram, so they can be undone without rendering again
+        pipeline = morse.FilterPipeline(cache.get_dft(y, sr, DEFAULTS, file_hash), sr, DEFAULTS)
         bin_size = get_bin_size(sr, DEFAULTS)
         window['-BINSIZE-'].update(f"{bin_size:.2f} Hz")
-        # Plot the spectrogram
-        fig, ax = plot(dft, sr, DEFAULTS)
-        fig_canvas_agg = draw_figure(window['-CANVAS-'].TKCanvas, fig)
-        setup_interactions(fig, dft, sr, DEFAULTS, window)
+        # Plot the spectrogram, the same figure is redrawn from then on
+        renderer = SpectrogramRenderer()
+        renderer.draw(pipeline, sr, DEFAULTS)
+        fig_canvas_agg = draw_figure(window['-CANVAS-'].TKCanvas, renderer.fig)
+        setup_interactions(renderer, window)
+        # heavy work runs in the background, the window stays responsive
+        tasks = TaskRunner(window)
+        # stages recorded while the Profile box is checked, kept after it is unchecked until the next run
+        tracer = None
+        # carrier found with the Auto band button and the band set around it, solve uses the carrier instead of
+        # searching the spectrogram until that band is replaced or undone, or the spectrogram is rendered again
+        carrier, carrier_band = None, None
         # Wait for the user interaction
         while True:
             event, values = window.read()
 
             if event == sg.WIN_CLOSED:
+                tasks.cancel()
+                profiling.stop()
                 break
             elif event == "-RENDER-":
                 window['-STATUS-'].update("Rendering...")
-                dft = morse.get_dft(y, sr, values)
-                bin_size = get_bin_size(sr, values)
-                window['-BINSIZE-'].update(f"{bin_size:.2f} Hz")
-                window['-STATUS-'].update('Rendered')
+                tasks.submit('render', render_task, y, sr, values, cache, file_hash, renderer)
             elif event == "-APPLY-":
-                window['-STATUS-'].update("Applying...")
-                dft = morse.tweak_dft(dft, sr, values)
+                if values['apply_freq_band'] and (values['freq_band_min'], values['freq_band_max']) != carrier_band:
+                    carrier = None
+                pipeline.apply(values)
                 window['-STATUS-'].update(value='Filters applied')
+            elif event == "-FIND-CARRIER-":
+                carrier, confidence = morse.estimate_carrier(y, sr, values)
+                band_min, band_max = morse.carrier_band(carrier, sr, values)
+                carrier_band = (f"{band_min:.0f}", f"{band_max:.0f}")
+                window['freq_band_min'].update(carrier_band[0])
+                window['freq_band_max'].update(carrier_band[1])
+                window['apply_freq_band'].update(True)
+                window['-STATUS-'].update(f"Carrier: {carrier:.2f} Hz (confidence {confidence:.2f}), "
+                                          f"apply the band to filter around it")
+            elif event == "-UNDO-":
+                removed = pipeline.undo()
+                if removed and removed[0] == 'freq_band':
+                    carrier = None
+                window['-STATUS-'].update(value='Filter removed' if removed else 'No filter to remove')
             elif event == "-DECODE-":
                 window['-DECODED-'].update(morse.decode(values['-ENCODED-']))
             elif event == "-SOLVE-":
                 window['-STATUS-'].update("Solving...")
-                code, status = morse.solve(dft, sr, values)
-                window['-STATUS-'].update(status)
-                window['-ENCODED-'].update(code)
-                window.refresh()
+                tasks.submit('solve', solve_task, pipeline.copy(), values, carrier)
+            elif event == "-AUTOTUNE-":
+                window['-STATUS-'].update(f"Auto-tuning for up to {AUTOTUNE_BUDGET:.0f} s...")
+                tasks.submit('auto-tune', autotune_task, y, sr, values)
+            elif event == "-BASEBAND-":
+                if values['-BASEBAND-'] and full_values is None:
+                    window['-STATUS-'].update("Shifting to baseband...")
+                    tasks.submit('baseband', baseband_task, y_full, sr_full, values)
+                elif not values['-BASEBAND-'] and full_values is None:
+                    # unchecked before the shift was done
+                    tasks.cancel('baseband')
+                    window['-STATUS-'].update('Baseband cancelled')
+                elif not values['-BASEBAND-']:
+                    y, sr = y_full, sr_full
+                    values = dict(values, **full_values)
+                    for key in BASEBAND_KEYS:
+                        window[key].update(full_values[key])
+                    full_values = None
+                    window['-SR-'].update(f"{sr} Hz")
+                    window['-STATUS-'].update("Rendering...")
+                    tasks.submit('render', render_task, y, sr, values, cache, file_hash, renderer)
+            elif event == "-CANCEL-":
+                tasks.cancel()
+                window['-PROGRESS-'].update(0)
+                window['-STATUS-'].update('Cancelled')
+            elif event == "-TASK-PROGRESS-":
+                generation, kind, fraction = values[event]
+                if tasks.is_current(kind, generation):
+                    window['-PROGRESS-'].update(int(100 * fraction))
+            elif event == "-TASK-ERROR-":
+                generation, kind, tb = values[event]
+                if tasks.is_current(kind, generation):
+                    print(tb)
+                    if kind == 'baseband':
+                        window['-BASEBAND-'].update(False)
+                    window['-PROGRESS-'].update(0)
+                    window['-STATUS-'].update(f"{kind.capitalize()} failed: {tb.strip().splitlines()[-1]}")
+            elif event == "-TASK-DONE-":
+                generation, kind, result = values[event]
+                if not tasks.is_current(kind, generation):
+                    continue
+                window['-PROGRESS-'].update(0)
+                if kind == 'solve':
+                    code, status = result
+                    window['-STATUS-'].update(status)
+                    window['-ENCODED-'].update(code)
+                elif kind == 'auto-tune':
+                    best, results = result
+                    if best is None:
+                        window['-STATUS-'].update('Auto-tune found nothing to decode')
+                        continue
+                    for key in TUNED_KEYS:
+                        window[key].update(best['values'][key])
+                    window['-ENCODED-'].update(best['code'])
+                    window['-DECODED-'].update(best['text'])
+                    window['-STATUS-'].update(f"Best of {len(results)} settings (score {best['score']:.2f}), "
+                                              f"Render and Apply to view | {best['status']}")
+                elif kind == 'baseband':
+                    if not values['-BASEBAND-'] or full_values is not None:
+                        continue
+                    # the same frame times and bin widths at the lower rate, then render the shifted signal
+                    full_values = {key: values[key] for key in BASEBAND_KEYS}
+                    y, sr, baseband_values = result
+                    values = dict(values, **{key: baseband_values[key] for key in BASEBAND_KEYS})
+                    for key in BASEBAND_KEYS:
+                        window[key].update(values[key])
+                    window['-SR-'].update(f"{sr} Hz (baseband)")
+                    window['-STATUS-'].update("Rendering...")
+                    tasks.submit('render', render_task, y, sr, values, cache, file_hash, renderer)
+                else:
+                    rendered, frame = result
+                    renderer.show(frame)
+                    fig_canvas_agg.draw_idle()
+                    if kind == 'render':
+                        pipeline, carrier = rendered, None
+                        bin_size = get_bin_size(sr, frame['values'])
+                        window['-BINSIZE-'].update(f"{bin_size:.2f} Hz")
+                        window['-STATUS-'].update('Rendered')
+            elif event == "-PROFILE-":
+                if values['-PROFILE-']:
+                    tracer = profiling.start()
+                else:
+                    profiling.stop()
+            elif event == 'Profile summary::-PROFILE-SUMMARY-':
+                show_profile('Check Profile and run a stage first.' if tracer is None else tracer.format_summary())
             elif event == 'About::-ABOUT-':
                 show_about()
 
-            if event in ("-PLOT-", "-RENDER-", "-APPLY-"):
-                plt.close('all')
-                fig_canvas_agg.get_tk_widget().forget()
-                fig, ax = plot(dft, sr, values)
-                fig_canvas_agg = draw_figure(window['-CANVAS-'].TKCanvas, fig)
-                setup_interactions(fig, dft, sr, values, window)
+            if event in ("-PLOT-", "-APPLY-", "-UNDO-"):
+                tasks.submit('plot', plot_task, pipeline.copy(), sr, values, renderer)
     except Exception as e:
         tb = traceback.format_exc()
         print(tb)
@@ -87,6 +288,7 @@ def event_loop(window):
 # ------------------------------------------------------ Driver ------------------------------------------------------ #
 
 if __name__ == '__main__':
+    setup_theme()
     filename = get_filename()
     if filename != None:
         # Create the window
@@ -1,13 +1,19 @@
+import concurrent.futures
+import functools
+import os
+
+# scipy.io and scipy.signal take most of the start-up time, they are imported by the functions that use them
 import numpy as np
-import sklearn.cluster
-import scipy.io.wavfile
-import scipy.signal
 
-from config import MORSE
-from util import bin_to_freq, frames_to_time, get_domains
+import codec
+import profiling
+from config import MORSE, TIMING_RATIOS
+from util import bin_to_freq, frames_to_time, get_base_freq, get_bin_size, get_domains
 
 
+@profiling.traced('load_file')
 def load_file(filename):
+    import scipy.io.wavfile
     sr, y = scipy.io.wavfile.read(filename)
     if y.ndim > 1:
         y = np.mean(y, axis=1).flatten()
@@ -15,130 +21,899 @@ def load_file(filename):
     return y, sr
 
 
-def get_dft(y, sr, values):
-    # get stft
+@profiling.traced('get_dft')
+def get_dft(y, sr, values, quantize=False, block_frames=None, progress=None, processes=1):
+    import scipy.signal
+
+    # get stft, in single precision. the zero padding of scipy.signal.stft is done here, as scipy would pad with
+    # float64 zeros and turn the whole signal back into double precision.
     n_fft = int(values['n_fft'])
     win_length = int(values['win_length'])
     hop_length = int(values['hop_length'])
-    f,t, stft = scipy.signal.stft(y, sr, window='hann', nperseg=win_length, noverlap=win_length-hop_length, nfft=n_fft)
+    n_frames = get_frame_count(len(y), values)
+
+    # processes > 1 (None: one per core) splits the frames between worker processes, for long files
+    processes = os.cpu_count() if processes is None else processes
+    if processes > 1 and n_frames > (block_frames or PARALLEL_BLOCK_FRAMES):
+        log_spec = _get_dft_parallel(y, sr, values, n_frames, processes, block_frames or PARALLEL_BLOCK_FRAMES,
+                                     progress)
+        return quantize_db(log_spec) if quantize else log_spec
+
+    samples = np.zeros((n_frames - 1) * hop_length + win_length, dtype=np.float32)
+    samples[win_length//2:win_length//2+len(y)] = y
+
+    # frames are transformed block_frames at a time (all at once by default), progress gets the fraction done
+    block_frames = n_frames if block_frames is None else block_frames
+    power = np.empty((n_fft // 2 + 1, n_frames), dtype=np.float32)
+    for start in range(0, n_frames, block_frames):
+        stop = min(n_frames, start + block_frames)
+        f,t, stft = scipy.signal.stft(samples[start*hop_length:(stop-1)*hop_length+win_length], sr, window='hann',
+                                      nperseg=win_length, noverlap=win_length-hop_length, nfft=n_fft, boundary=None,
+                                      padded=False)
+        get_power(stft, out=power[:, start:stop])
+        del stft
+        if progress is not None:
+            progress(stop / n_frames)
+    del samples
+
+    # convert to dB in place
+    log_spec = power_to_db(power, np.max(power))
+    np.maximum(log_spec, log_spec.max() - TOP_DB, out=log_spec)
+
+    return quantize_db(log_spec) if quantize else log_spec
+
+
+# ----------------------------------------------- Spectrogram Storage ------------------------------------------------ #
+# spectrograms are float32 dB, 0 dB being the strongest value and -TOP_DB the floor. quantize_db turns them into int8
+# whole dB (1 dB steps over -80..0), a quarter of the memory; tweak_dft, solve and plot accept either.
+
+AMIN = 1e-10
+TOP_DB = 80.0
+
+
+def get_power(stft, out=None):
+    # float32 power straight from the real and imaginary parts, without the magnitude in between
+    power = np.square(stft.real, out=out, dtype=np.float32)
+    power += np.square(stft.imag, dtype=np.float32)
+    return power
+
+
+def power_to_db(power, ref_value):
+    # in place, power becomes dB relative to ref_value
+    np.maximum(power, AMIN, out=power)
+    np.log10(power, out=power)
+    power *= 10.0
+    power -= 10.0 * np.log10(max(AMIN, ref_value))
+    return power
+
+
+def quantize_db(dft):
+    return np.rint(dft).astype(np.int8)
+
+
+# -------------------------------------------------- Parallel STFT --------------------------------------------------- #
+# the padded signal and the spectrogram live in shared memory. workers transform hop aligned, overlapping blocks of
+# frames into their columns of the output, then convert their columns to dB once the global maximum is known. every
+# step is the one get_dft takes, on the same frames, so the result is identical.
+
+PARALLEL_BLOCK_FRAMES = 4096
+
+_shared = None
+
+
+def _attach_shared(samples_name, n_samples, out_name, shape, sr, values):
+    from multiprocessing import shared_memory
+    global _shared
+    samples_shm = shared_memory.SharedMemory(samples_name)
+    out_shm = shared_memory.SharedMemory(out_name)
+    _shared = {'samples_shm': samples_shm, 'out_shm': out_shm, 'sr': sr, 'values': values,
+               'samples': np.ndarray((n_samples,), dtype=np.float32, buffer=samples_shm.buf),
+               'out': np.ndarray(shape, dtype=np.float32, buffer=out_shm.buf)}
+
+
+def _power_block(block):
+    # power of frames [start, stop), returns their maximum
+    import scipy.signal
+    start, stop = block
+    values = _shared['values']
+    win_length = int(values['win_length'])
+    hop_length = int(values['hop_length'])
+    f,t, stft = scipy.signal.stft(_shared['samples'][start*hop_length:(stop-1)*hop_length+win_length], _shared['sr'],
+                                  window='hann', nperseg=win_length, noverlap=win_length-hop_length,
+                                  nfft=int(values['n_fft']), boundary=None, padded=False)
+    out = get_power(stft, out=_shared['out'][:, start:stop])
+    return np.max(out)
 
-    # convert to dB
-    amin = 1e-10
-    top_db = 80.0
-    magnitude = np.abs(stft)
-    ref_value = np.max(magnitude) ** 2
-    power = np.square(magnitude, out=magnitude)
 
-    log_spec = 10.0 * np.log10(np.maximum(amin, power))
-    log_spec -= 10.0 * np.log10(np.maximum(amin, ref_value))
-    log_spec = np.maximum(log_spec, log_spec.max() - top_db)
+def _db_block(block, ref_value):
+    # dB of frames [start, stop), returns their maximum
+    start, stop = block
+    return power_to_db(_shared['out'][:, start:stop], ref_value).max()
 
+
+def _get_dft_parallel(y, sr, values, n_frames, processes, block_frames, progress=None):
+    from multiprocessing import shared_memory
+    win_length = int(values['win_length'])
+    hop_length = int(values['hop_length'])
+    n_samples = (n_frames - 1) * hop_length + win_length
+    shape = (int(values['n_fft']) // 2 + 1, n_frames)
+    blocks = [(start, min(n_frames, start + block_frames)) for start in range(0, n_frames, block_frames)]
+
+    samples_shm = shared_memory.SharedMemory(create=True, size=n_samples * 4)
+    out_shm = shared_memory.SharedMemory(create=True, size=shape[0] * shape[1] * 4)
+    try:
+        # new shared memory is zero filled, only the signal itself is copied in
+        samples = np.ndarray((n_samples,), dtype=np.float32, buffer=samples_shm.buf)
+        samples[win_length//2:win_length//2+len(y)] = y
+        del samples
+
+        executor = concurrent.futures.ProcessPoolExecutor(
+            min(processes, len(blocks)), initializer=_attach_shared,
+            initargs=(samples_shm.name, n_samples, out_shm.name, shape, sr, values))
+        try:
+            # first pass: power spectrum, and its maximum as the dB reference
+            ref_value = 0.0
+            for i, block_max in enumerate(executor.map(_power_block, blocks)):
+                ref_value = max(ref_value, block_max)
+                if progress is not None:
+                    progress((i + 1) / len(blocks))
+            # second pass: dB in place, and its maximum for the floor
+            max_db = max(executor.map(_db_block, blocks, [ref_value] * len(blocks)))
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        # the floor is applied while copying the result out of shared memory
+        log_spec = np.empty(shape, dtype=np.float32)
+        shared = np.ndarray(shape, dtype=np.float32, buffer=out_shm.buf)
+        for start, stop in blocks:
+            np.maximum(shared[:, start:stop], max_db - TOP_DB, out=log_spec[:, start:stop])
+        del shared
+    finally:
+        samples_shm.close()
+        samples_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
     return log_spec
 
 
+# -------------------------------------------- Chunked Load And Transform -------------------------------------------- #
+
+def load_file_mmap(filename):
+    import scipy.io.wavfile
+    sr, y = scipy.io.wavfile.read(filename, mmap=True)
+    return y, sr
+
+
+def mix_down(block):
+    # a multichannel block of samples becomes the mean of its channels
+    if block.ndim > 1:
+        block = np.mean(block, axis=1).flatten()
+    return block
+
+
+def get_peaks(y, block_size=1 << 20):
+    # first pass: the same (min, max) that load_file normalizes with, without loading the whole file
+    lo, hi = np.inf, -np.inf
+    for start in range(0, len(y), block_size):
+        block = mix_down(y[start:start+block_size])
+        lo = min(lo, block.min())
+        hi = max(hi, block.max())
+    return lo, hi
+
+
+def read_normalized(y, peaks, start, stop, pad=0):
+    # samples [start, stop) of the signal as get_dft sees it: normalized, in single precision and zero padded at front
+    block = np.zeros(stop - start, dtype=np.float32)
+    src_start, src_stop = max(0, start - pad), min(len(y), stop - pad)
+    if src_start < src_stop:
+        samples = mix_down(y[src_start:src_stop])
+        block[src_start+pad-start:src_stop+pad-start] = np.interp(samples, peaks, (-1, 1))
+    return block
+
+
+def get_frame_count(n_samples, values):
+    win_length = int(values['win_length'])
+    hop_length = int(values['hop_length'])
+    extended = n_samples + 2 * (win_length // 2)
+    extended += (-(extended - win_length) % hop_length) % win_length
+    return (extended - win_length) // hop_length + 1
+
+
+def get_stft_block(y, peaks, sr, values, frame_start, frame_stop):
+    # frames [frame_start, frame_stop) of the stft used by get_dft, computed from the overlapping samples only
+    import scipy.signal
+    n_fft = int(values['n_fft'])
+    win_length = int(values['win_length'])
+    hop_length = int(values['hop_length'])
+    samples = read_normalized(y, peaks, frame_start * hop_length, (frame_stop - 1) * hop_length + win_length,
+                              pad=win_length // 2)
+    _, _, stft = scipy.signal.stft(samples, sr, window='hann', nperseg=win_length, noverlap=win_length-hop_length,
+                                   nfft=n_fft, boundary=None, padded=False)
+    return stft
+
+
+@profiling.traced('get_dft')
+def get_dft_chunked(filename, values, block_frames=4096, out=None):
+    # same result as get_dft(*load_file(filename), values), but memory is bound by block_frames, not the file length.
+    # pass a np.memmap as `out` to keep the spectrogram itself out of memory as well.
+    y, sr = load_file_mmap(filename)
+    peaks = get_peaks(y)
+    n_frames = get_frame_count(len(y), values)
+    if out is None:
+        out = np.empty((int(values['n_fft']) // 2 + 1, n_frames), dtype=np.float32)
+
+    # power spectrum, block by block
+    ref_value = 0.0
+    for start in range(0, n_frames, block_frames):
+        stop = min(n_frames, start + block_frames)
+        get_power(get_stft_block(y, peaks, sr, values, start, stop), out=out[:, start:stop])
+        ref_value = max(ref_value, np.max(out[:, start:stop]))
+
+    # convert to dB in place
+    max_db = -np.inf
+    for start in range(0, n_frames, block_frames):
+        block = power_to_db(out[:, start:start+block_frames], ref_value)
+        max_db = max(max_db, block.max())
+    for start in range(0, n_frames, block_frames):
+        block = out[:, start:start+block_frames]
+        np.maximum(block, max_db - TOP_DB, out=block)
+
+    return out, sr
+
+
+# ------------------------------------------------ Baseband Front End ------------------------------------------------ #
+# a carrier takes a few tens of hertz, not the whole audio band. the band around it is mixed down to 0 Hz, low-pass
+# filtered and decimated by a chain of polyphase stages, and turned back into a real signal centered at a quarter of the
+# new sample rate. values['base_freq'] then holds the frequency that 0 Hz of the new signal stands for, which the
+# conversions of util add back, so frequencies stay absolute. times need no correction.
+
+BASEBAND_WIDTH = 400.0  # Hz, kept around an estimated carrier
+MAX_DECIMATION = 100
+STOPBAND_DB = 60.0
+QUARTER_TURNS = np.array([1, 1j, -1, -1j], dtype=np.complex64)
+
+
+def decimation_stages(factor):
+    # one stage per prime factor, largest first: the early stages run at the high rates but have wide transition
+    # bands and short filters, the last one has the narrow transition and the smallest factor, so its long filter
+    # runs at the lowest rate
+    stages = []
+    p = 2
+    while factor > 1:
+        while factor % p == 0:
+            stages.append(p)
+            factor //= p
+        p += 1
+    return stages[::-1]
+
+
+def baseband_plan(sr, band):
+    # (center frequency, decimation) of a band (min, max) in Hz. the decimation is the largest factor of sr, up to
+    # MAX_DECIMATION, that leaves a sample rate of at least 2.5 times the band: the band sits between a quarter and
+    # three quarters of the new nyquist frequency, with room for the filter transitions on both sides
+    width = band[1] - band[0]
+    factors = [d for d in range(2, MAX_DECIMATION + 1) if sr % d == 0 and sr / d >= 2.5 * width]
+    return (band[0] + band[1]) / 2, max(factors, default=1)
+
+
+@profiling.traced('to_baseband')
+def to_baseband(y, sr, values, band=None, block_size=1 << 22):
+    # returns the shifted signal, its sample rate, and values for it: base_freq set and the stft sizes scaled with the
+    # sample rate, so a frame spans the same time and a bin the same width as before. a band that leaves nothing to
+    # decimate returns y, sr and values as they are.
+    # band: (min, max) in Hz, by default the frequency band filter if it is applied, else BASEBAND_WIDTH around the
+    # estimated carrier. the signal is processed block_size samples at a time
+    import scipy.signal
+    if band is None:
+        if values['apply_freq_band'] and values['freq_band_min'] != '' and values['freq_band_max'] != '':
+            band = float(values['freq_band_min']), float(values['freq_band_max'])
+        else:
+            carrier, _ = estimate_carrier(y, sr, values)
+            band = carrier - BASEBAND_WIDTH / 2, carrier + BASEBAND_WIDTH / 2
+    base_freq = get_base_freq(values)
+    band = max(base_freq, band[0]), min(base_freq + sr / 2, band[1])
+    center, factor = baseband_plan(sr, band)
+    if factor == 1:
+        # nothing to decimate: the band is too wide for the sample rate, and shifting it alone would fold the negative
+        # frequencies onto it without a stage to stop them
+        profiling.record(factor=factor, stages=[], taps=[])
+        return y, sr, values
+    width = band[1] - band[0]
+    new_sr = sr // factor if sr % factor == 0 else sr / factor
+
+    # every stage keeps the band and stops what its decimation would fold onto the band or onto the transition of the
+    # last stage. the last one also stops the top of the new spectrum, which the real signal mirrors onto the band
+    stopband = new_sr / 2 - width / 2
+    stages = decimation_stages(factor)
+    filters = []
+    rate, step = sr, 1
+    context = 0  # input samples a block needs on either side
+    for i, down in enumerate(stages):
+        edge = stopband if i == len(stages) - 1 else rate / down - stopband
+        numtaps, beta = scipy.signal.kaiserord(STOPBAND_DB, (edge - width / 2) / (rate / 2))
+        taps = scipy.signal.firwin(numtaps | 1, (edge + width / 2) / 2, window=('kaiser', beta), fs=rate)
+        filters.append((down, taps.astype(np.float32)))
+        context += len(taps) // 2 * step
+        rate, step = rate / down, step * down
+    profiling.record(factor=factor, stages=stages, taps=[len(taps) for _, taps in filters])
+
+    # blocks and their context are whole multiples of the decimation, so every output sample k is input sample k *
+    # factor, as if the whole signal was filtered at once
+    pad = -(-context // factor) * factor
+    block_size = max(1, block_size // factor) * factor
+    # the oscillator of a block is the same up to its starting phase
+    mix = 2 * np.pi * (center - base_freq) / sr
+    oscillator = np.exp(-1j * mix * np.arange(block_size + 2 * pad)).astype(np.complex64)
+    out = np.empty(-(-len(y) // factor), dtype=np.float32)
+    for start in range(0, len(y), block_size):
+        stop = min(len(y), start + block_size)
+        src_start, src_stop = max(0, start - pad), min(len(y), stop + pad)
+        segment = np.zeros(stop - start + 2 * pad, dtype=np.complex64)
+        phase = np.complex64(np.exp(-1j * mix * src_start))
+        np.multiply(y[src_start:src_stop], oscillator[:src_stop - src_start] * phase,
+                    out=segment[src_start - start + pad:src_stop - start + pad], casting='same_kind')
+        for down, taps in filters:
+            segment = scipy.signal.resample_poly(segment, 1, down, window=taps)
+        k = np.arange(start // factor, -(-stop // factor))
+        segment = segment[pad // factor:pad // factor + len(k)]
+        # from 0 Hz up to a quarter of the sample rate, the real part keeps the amplitude when doubled
+        out[k] = 2 * (segment * QUARTER_TURNS[k % 4]).real
+
+    scaled = {key: str(max(1, round(int(values[key]) / factor))) for key in ('n_fft', 'win_length', 'hop_length')}
+    base_freq = center - new_sr / 4
+    return out, new_sr, dict(values, base_freq=str(base_freq), **scaled)
+
+
+# ---------------------------------------------- Single Carrier Envelope --------------------------------------------- #
+
+@profiling.traced('estimate_carrier')
+def estimate_carrier(y, sr, values, max_segments=256, peaks=None):
+    # welch-style: the log periodograms of up to max_segments evenly spaced, hann windowed segments of n_fft samples
+    # are averaged (in dB, like the dominant bin search of solve, so a steady carrier beats short bursts), so the cost
+    # does not grow with the file length. the peak is refined between bins by a parabola through it and its
+    # neighbours. returns (frequency in Hz, confidence): the confidence is the share of the peak that stands out of
+    # the median of the spectrum, 1 - 10^(-prominence/10), about 0.2 for noise alone and close to 1 for a clean carrier.
+    # y may also be the samples of load_file_mmap with their get_peaks, only the segments are then read and normalized
+    import scipy.signal
+    n_fft = int(values['n_fft'])
+    if len(y) < n_fft:
+        y = np.pad(y, [(0, n_fft - len(y))] + [(0, 0)] * (y.ndim - 1))
+    n_segments = min(max_segments, len(y) // n_fft)
+    starts = np.linspace(0, len(y) - n_fft, n_segments).astype(int)
+    window = scipy.signal.get_window('hann', n_fft)
+    segments = y[starts[:, None] + np.arange(n_fft)]
+    if peaks is not None:
+        segments = np.interp(np.mean(segments, axis=2) if segments.ndim > 2 else segments, peaks, (-1, 1))
+    # without their mean, as in welch: the offset load_file's normalization leaves would leak into the lowest bins
+    segments = segments - np.mean(segments, axis=1, keepdims=True)
+    power = np.square(np.abs(np.fft.rfft(segments * window, axis=1)))
+    spectrum = np.mean(10.0 * np.log10(np.maximum(AMIN, power)), axis=0)
+
+    peak = int(np.argmax(spectrum[1:])) + 1  # a dc offset is not a carrier
+    offset = 0.0
+    if 0 < peak < len(spectrum) - 1:
+        left, center, right = spectrum[peak - 1:peak + 2]
+        curvature = left - 2 * center + right
+        if curvature < 0:
+            offset = 0.5 * (left - right) / curvature
+    freq = float((peak + offset) * sr / n_fft) + get_base_freq(values)
+    confidence = 1 - 10 ** (-(spectrum[peak] - np.median(spectrum)) / 10)
+    profiling.record(segments=n_segments, peak_bin=peak, offset=offset, confidence=confidence)
+    return freq, float(np.clip(confidence, 0, 1))
+
+
+def carrier_band(freq, sr, values, bins=3):
+    # (min, max) frequency band filter around a carrier, `bins` fft bins to either side
+    width = bins * get_bin_size(sr, values)
+    base_freq = get_base_freq(values)
+    return max(base_freq, freq - width), min(base_freq + sr / 2, freq + width)
+
+
+@profiling.traced('get_envelope')
+def get_envelope(y, sr, values, freq, block_frames=4096):
+    # the get_dft row of a single frequency, computed as a single-bin dft of every frame and mapped to [0, 1].
+    # the reference is the strongest value of the row itself, which is the global maximum of get_dft whenever the
+    # carrier is the dominant signal, and the floor is top_db below it as in get_dft.
+    import scipy.signal
+    win_length = int(values['win_length'])
+    hop_length = int(values['hop_length'])
+    window = scipy.signal.get_window('hann', win_length)
+    freq = freq - get_base_freq(values)
+    kernel = window * np.exp(-2j * np.pi * freq * np.arange(win_length) / sr) / window.sum()
+
+    n_frames = get_frame_count(len(y), values)
+    ext = np.concatenate((np.zeros(win_length // 2), y, np.zeros(win_length)))
+    power = np.empty(n_frames)
+    for start in range(0, n_frames, block_frames):
+        stop = min(n_frames, start + block_frames)
+        segment = ext[start * hop_length:(stop - 1) * hop_length + win_length]
+        frames = np.lib.stride_tricks.sliding_window_view(segment, win_length)[::hop_length]
+        power[start:stop] = np.square(np.abs(frames @ kernel))
+
+    # convert to dB in place, as get_dft does
+    log_spec = power_to_db(power, np.max(power))
+    np.maximum(log_spec, -TOP_DB, out=log_spec)
+    return np.interp(log_spec, [-TOP_DB, 0], [0, 1])
+
+
+@profiling.traced('tweak_dft')
 def tweak_dft(dft, sr, values):
-    # apply threshold db filter
-    if(values['apply_threshold_db']):
-        threshold_db = -80 if values['threshold_db'] == '' else float(values['threshold_db'])
-        dft = np.where(dft > threshold_db, dft, -80).astype(np.int8)
-
-    boundaries = (values['time_band_min'], values['time_band_max'], values['freq_band_min'], values['freq_band_max'])
-    time_domain, freq_domain = get_domains(dft.shape, sr, boundaries, values)
-
-    # apply frequency band filter
-    if values['apply_freq_band']:
-        top = np.zeros((freq_domain[0], dft.shape[1]), dtype=np.int8) - 80
-        bottom = np.zeros((dft.shape[0] - freq_domain[1], dft.shape[1]), dtype=np.int8) - 80
-        dft = np.concatenate((top, dft[freq_domain[0]:freq_domain[1], :], bottom), axis=0)
-    # apply time band filter
-    if values['apply_time_band']:
-        top = np.zeros((dft.shape[0], time_domain[0]), dtype=np.int8) - 80
-        bottom = np.zeros((dft.shape[0], dft.shape[1] - time_domain[1]), dtype=np.int8) - 80
-        dft = np.concatenate((top, dft[:, time_domain[0]:time_domain[1]], bottom), axis=1)
-    # return dft
-    return dft
-
-
-def solve(dft, sr, values):
-    interp = np.interp(dft, [np.amin(dft), np.amax(dft)], [0, 1])  # map to [0, 1]
+    # apply threshold db, frequency band and time band filters
+    pipeline = FilterPipeline(dft, sr, values)
+    pipeline.apply(values)
+    return pipeline.materialize()
+
+
+# ------------------------------------------------- Filter Pipeline ------------------------------------------------- #
+
+class FilterPipeline:
+    # threshold and band filters recorded over an unfiltered spectrogram. nothing is computed until a region is
+    # materialized, and then only that region, so filters can be undone or reordered without rendering again.
+
+    def __init__(self, dft, sr, values):
+        # values: the stft parameters dft was rendered with
+        self.dft = dft
+        self.sr = sr
+        self.values = values
+        self.filters = []
+
+    @property
+    def shape(self):
+        return self.dft.shape
+
+    def apply(self, values):
+        # record the filters checked in values, returns how many were added
+        added = []
+        if values['apply_threshold_db']:
+            added.append(('threshold_db', -80 if values['threshold_db'] == '' else float(values['threshold_db'])))
+
+        boundaries = (values['time_band_min'], values['time_band_max'], values['freq_band_min'], values['freq_band_max'])
+        time_domain, freq_domain = get_domains(self.shape, self.sr, boundaries, self.values)
+        if values['apply_freq_band']:
+            added.append(('freq_band', freq_domain))
+        if values['apply_time_band']:
+            added.append(('time_band', time_domain))
+
+        self.filters.extend(added)
+        return len(added)
+
+    def copy(self):
+        # shares the spectrogram, not the filter list
+        pipeline = FilterPipeline(self.dft, self.sr, self.values)
+        pipeline.filters = list(self.filters)
+        return pipeline
+
+    def undo(self):
+        return self.filters.pop() if self.filters else None
+
+    def move(self, src, dst):
+        self.filters.insert(dst, self.filters.pop(src))
+
+    def clear(self):
+        self.filters = []
+
+    def get_bands(self):
+        # ((time_min, time_max), (freq_min, freq_max)) left untouched by the band filters
+        time_min, time_max, freq_min, freq_max = 0, self.shape[1], 0, self.shape[0]
+        for kind, arg in self.filters:
+            if kind == 'time_band':
+                time_min, time_max = max(time_min, arg[0]), min(time_max, arg[1])
+            elif kind == 'freq_band':
+                freq_min, freq_max = max(freq_min, arg[0]), min(freq_max, arg[1])
+        return (time_min, max(time_min, time_max)), (freq_min, max(freq_min, freq_max))
+
+    @profiling.traced('filters')
+    def materialize(self, region=None):
+        # region: ((time_min, time_max), (freq_min, freq_max)) in frames and bins, the whole spectrogram by default
+        (time_min, time_max), (freq_min, freq_max) = ((0, self.shape[1]), (0, self.shape[0])) if region is None \
+            else region
+        return self.apply_filters(np.array(self.dft[freq_min:freq_max, time_min:time_max]), time_min, freq_min)
+
+    def apply_filters(self, out, time_min=0, freq_min=0, frames_per_column=1):
+        # filter, in place, a piece of the spectrogram starting at bin freq_min and column time_min. its columns may
+        # each cover several frames, as in a downsampled copy: a column is then left out of a time band only as a whole.
+        for kind, arg in self.filters:
+            if kind == 'threshold_db':
+                np.copyto(out, -80, where=~(out > arg))
+            elif kind == 'freq_band':
+                out[:max(0, arg[0] - freq_min)] = -80
+                out[max(0, arg[1] - freq_min):] = -80
+            elif kind == 'time_band':
+                out[:, :max(0, arg[0] // frames_per_column - time_min)] = -80
+                out[:, max(0, -(-arg[1] // frames_per_column) - time_min):] = -80
+        return out
+
+    def value_at(self, freq_bin, frame):
+        return self.materialize(((frame, frame + 1), (freq_bin, freq_bin + 1)))[0, 0]
+
+    def solve(self, values, carrier=None, stats=None, events=False):
+        return solve(**self._solve_args(values, carrier, stats), events=events)
+
+    def solve_segments(self, values, carrier=None, stats=None, **kwargs):
+        # kwargs: min_silence and processes of solve_segments
+        return solve_segments(**self._solve_args(values, carrier, stats), **kwargs)
+
+    def _solve_args(self, values, carrier, stats):
+        # solve only the band region: outside of it everything is at the floor, which can neither be the dominant
+        # frequency nor add edges, only the floor has to be counted in the range mapped to [0, 1]. a carrier (Hz)
+        # outside of the band is ignored. frame_offset keeps the times found counting from the start of the file
+        (time_min, time_max), (freq_min, freq_max) = self.get_bands()
+        region = self.materialize(((time_min, time_max), (freq_min, freq_max)))
+        value_range = [np.amin(region), np.amax(region)]
+        if region.shape != self.shape:
+            value_range = [min(value_range[0], -80), max(value_range[1], -80)]
+        if carrier is not None:
+            carrier_bin = round((carrier - get_base_freq(self.values)) / get_bin_size(self.sr, self.values))
+            if not freq_min <= carrier_bin < freq_max:
+                carrier = None
+        return dict(dft=region, sr=self.sr, values=values, freq_offset=freq_min, value_range=value_range,
+                    carrier=carrier, stats=stats, frame_offset=time_min)
+
+
+# ------------------------------------------------- Timing Clusters ------------------------------------------------- #
+
+def _segment_cost(s1, s2, w, i, j):
+    # sum of squared deviations of the values i..j-1 from their mean, from prefix sums
+    n = w[j] - w[i]
+    return s2[j] - s2[i] - (s1[j] - s1[i]) ** 2 / n
+
+
+def _kmeans_1d_dp(points, weights, k):
+    # exact 1-d k-means over sorted distinct points, O(k n log n) with the divide and conquer optimization.
+    # returns the start index of every cluster.
+    n = len(points)
+    w = np.concatenate(([0], np.cumsum(weights)))
+    s1 = np.concatenate(([0], np.cumsum(weights * points)))
+    s2 = np.concatenate(([0], np.cumsum(weights * points ** 2)))
+
+    cost = np.full((k + 1, n + 1), np.inf)
+    split = np.zeros((k + 1, n + 1), dtype=int)
+    cost[1, 1:] = _segment_cost(s1, s2, w, 0, np.arange(1, n + 1))
+
+    def fill(m, lo, hi, opt_lo, opt_hi):
+        # cost[m, j] for j in [lo, hi), knowing its best split lies in [opt_lo, opt_hi]
+        if lo >= hi:
+            return
+        j = (lo + hi) // 2
+        i = np.arange(max(m - 1, opt_lo), min(j - 1, opt_hi) + 1)
+        candidates = cost[m - 1, i] + _segment_cost(s1, s2, w, i, j)
+        best = i[np.argmin(candidates)]
+        cost[m, j], split[m, j] = np.min(candidates), best
+        fill(m, lo, j, opt_lo, best)
+        fill(m, j + 1, hi, best, opt_hi)
+
+    for m in range(2, k + 1):
+        fill(m, m, n + 1, m - 1, n - 1)
+
+    starts = [0] * k
+    j = n
+    for m in range(k, 1, -1):
+        j = split[m, j]
+        starts[m - 1] = j
+    return np.array(starts)
+
+
+def cluster_1d(x, k, ratios=None):
+    # deterministic replacement for KMeans on durations: exact 1-d k-means over the distinct values, or with `ratios`
+    # (e.g. TIMING_RATIOS) a single time unit fitted so the centers keep those ratios.
+    # returns the centers in ascending order and the label of every value, 0 being the shortest.
+    points, inverse, counts = np.unique(np.asarray(x, dtype=float), return_inverse=True, return_counts=True)
+    default_ratios = np.asarray(TIMING_RATIOS[:k] if ratios is None else ratios[:k], dtype=float)
+
+    if len(points) <= k:
+        # not enough distinct durations, the ones present take the shortest labels and the rest follow the ratios
+        centers = np.concatenate((points, points[-1] * default_ratios[len(points):] / default_ratios[len(points) - 1]))
+    else:
+        starts = _kmeans_1d_dp(points, counts, k)
+        point_labels = np.searchsorted(starts, np.arange(len(points)), side='right') - 1
+        centers = np.bincount(point_labels, counts * points, k) / np.bincount(point_labels, counts, k)
+
+    if ratios is not None:
+        # refine a single unit against the fixed ratios
+        unit = centers[0] / default_ratios[0]
+        for _ in range(20):
+            point_labels = np.searchsorted((default_ratios[1:] + default_ratios[:-1]) / 2 * unit, points)
+            r = default_ratios[point_labels]
+            new_unit = np.sum(counts * r * points) / np.sum(counts * r * r)
+            if np.isclose(new_unit, unit):
+                break
+            unit = new_unit
+        centers = unit * default_ratios
+
+    point_labels = np.searchsorted((centers[1:] + centers[:-1]) / 2, points)
+    return centers, point_labels[inverse.reshape(-1)]
+
+
+# -------------------------------------------------- Keying Events -------------------------------------------------- #
+
+# one record per mark: its first frame, the frame after its last, DOT or DASH, and the spacing label of the gap that
+# follows it (-1 after the last mark)
+EVENT_DTYPE = np.dtype([('start', np.int64), ('end', np.int64), ('kind', np.int8), ('gap', np.int8)])
+# one record per character of the text, times in seconds. spaces span the gap between two words
+TRANSCRIPT_DTYPE = np.dtype([('char', 'U1'), ('start', np.float64), ('end', np.float64)])
+
+
+class Keying:
+    # what solve found, kept as arrays. the code string, the text and the transcript are only built when asked for,
+    # str() gives the code
+
+    def __init__(self, events, sr, values):
+        self.events = events
+        self.sr = sr
+        self.values = values
+
+    @classmethod
+    def from_labels(cls, start, end, symbol_labels, spacing_labels, sr, values, frame_offset=0):
+        # start and end are frames of an envelope that begins frame_offset frames into the spectrogram
+        events = np.empty(len(symbol_labels), dtype=EVENT_DTYPE)
+        events['start'] = start + frame_offset
+        events['end'] = end + frame_offset
+        events['kind'] = symbol_labels
+        events['gap'][:-1] = spacing_labels
+        events['gap'][-1:] = -1
+        return cls(events, sr, values)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __str__(self):
+        return self.code
+
+    @functools.cached_property
+    def letters(self):
+        # index of the first mark of every letter
+        return np.concatenate(([0], np.flatnonzero(self.events['gap'][:-1] != codec.SYMBOL_SPACING) + 1))[:len(self)]
+
+    @functools.cached_property
+    def words(self):
+        # index of the first mark of every word
+        return np.concatenate(([0], np.flatnonzero(self.events['gap'][:-1] == codec.WORD_SPACING) + 1))[:len(self)]
+
+    @functools.cached_property
+    def code(self):
+        return codec.encode_code(self.events['kind'], self.events['gap'][:-1])
+
+    @functools.cached_property
+    def text(self):
+        # same as decode(self.code)
+        return codec.decode_symbols(self.events['kind'], self.events['gap'][:-1])
+
+    @functools.cached_property
+    def transcript(self):
+        if not len(self):
+            return np.empty(0, dtype=TRANSCRIPT_DTYPE)
+        packed, word_end = codec.pack_symbols(self.events['kind'], self.events['gap'][:-1])
+        letter_end = np.concatenate((self.letters[1:], [len(self)])) - 1
+        letter_times = frames_to_time(self.events['start'][self.letters], self.sr, self.values)
+        letter_end_times = frames_to_time(self.events['end'][letter_end], self.sr, self.values)
+
+        # a space after every word but the last, from the end of its last letter to the start of the next word
+        spaces = np.flatnonzero(word_end[:-1])
+        transcript = np.empty(len(packed) + len(spaces), dtype=TRANSCRIPT_DTYPE)
+        letter_pos = np.arange(len(packed)) + np.concatenate(([0], np.cumsum(word_end[:-1])))
+        transcript['char'][letter_pos] = codec.LETTERS[packed]
+        transcript['start'][letter_pos] = letter_times
+        transcript['end'][letter_pos] = letter_end_times
+        transcript['char'][letter_pos[spaces] + 1] = ' '
+        transcript['start'][letter_pos[spaces] + 1] = letter_end_times[spaces]
+        transcript['end'][letter_pos[spaces] + 1] = letter_times[spaces + 1]
+        return transcript
+
+
+@profiling.traced('solve')
+def solve(dft, sr, values, freq_offset=0, value_range=None, carrier=None, stats=None, events=False, frame_offset=0):
+    # dft may also be a region of the spectrogram whose rows start at bin freq_offset and columns at frame
+    # frame_offset, value_range is then the (min, max) of the whole spectrogram. carrier: frequency (Hz) found
+    # beforehand, e.g. by estimate_carrier. stats: optional dict that receives the carrier (Hz) and the timings found,
+    # see solve_envelope. events: return a Keying instead of the code string
     status = []
+    envelope = dominant_envelope(dft, sr, values, freq_offset, value_range, carrier, status, stats)
+    return solve_envelope(envelope, sr, values, status, stats, events, frame_offset)
 
-    # -------------------------------------------- Find Dominant Frequency ------------------------------------------- #
-    dominant_freq_bin = np.argmax(np.mean(interp, axis=1), axis=0)
-    status.append('Dominant frequency found between: {:.2f} Hz and {:.2f} Hz'.format(
-        bin_to_freq(dominant_freq_bin, sr, values), bin_to_freq(dominant_freq_bin+1, sr, values)))
 
-    # ----------------------------------- Find The Positions Of Rising And Falling ----------------------------------- #
-    binary_data = np.where(interp[dominant_freq_bin] > 0.85, 1, 0)  # 0.85 is the threshold
-    diff = np.diff(binary_data)  # find the differences between consecutive values to find the rising and falling
-    rising_idx = np.nonzero(diff == 1)[0]
-    falling_idx = np.nonzero(diff == -1)[0]
+def dominant_envelope(dft, sr, values, freq_offset=0, value_range=None, carrier=None, status=None, stats=None):
+    # the row of the dominant frequency (or of the carrier) mapped to [0, 1], see solve for the arguments
+    if value_range is None:
+        value_range = [np.amin(dft), np.amax(dft)]
 
-    # if we only observed the falling edge, we need to add the rising edge at the beginning
-    if falling_idx[0] < rising_idx[0]:
-        rising_idx = np.insert(rising_idx, 0, -1)
+    # -------------------------------------------- Find Dominant Frequency ------------------------------------------- #
+    # the mapping to [0, 1] is monotonic, so the dominant bin can be found before it and only one row has to be mapped
+    if carrier is None:
+        dominant_row = np.argmax(np.mean(dft, axis=1), axis=0)
+    else:
+        # no pass over the spectrogram needed, just the nearest row
+        carrier_bin = round((carrier - get_base_freq(values)) / get_bin_size(sr, values))
+        dominant_row = int(np.clip(carrier_bin - freq_offset, 0, dft.shape[0] - 1))
+    dominant_freq_bin = dominant_row + freq_offset
+    if status is not None:
+        status.append('Dominant frequency found between: {:.2f} Hz and {:.2f} Hz'.format(
+            bin_to_freq(dominant_freq_bin, sr, values), bin_to_freq(dominant_freq_bin+1, sr, values)))
+    envelope = np.interp(dft[dominant_row], value_range, [0, 1])  # map to [0, 1]
+    profiling.record(dominant_freq_bin=dominant_freq_bin, value_range=value_range)
+    if stats is not None:
+        stats['carrier'] = bin_to_freq(dominant_freq_bin, sr, values)  # bin k is centered at k * sr / n_fft
+    return envelope
+
+
+@profiling.traced('solve_carrier')
+def solve_carrier(y, sr, values, freq=None):
+    # decode from the keying envelope of a single carrier, without computing the spectrogram
+    if freq is None:
+        freq, confidence = estimate_carrier(y, sr, values)
+        status = ['Carrier frequency: {:.2f} Hz (confidence {:.2f})'.format(freq, confidence)]
+    else:
+        status = ['Carrier frequency: {:.2f} Hz'.format(freq)]
+    return solve_envelope(get_envelope(y, sr, values, freq), sr, values, status)
+
+
+ENVELOPE_THRESHOLD = 0.85  # envelope values above it are keyed
+
+
+@profiling.traced('solve_envelope')
+def solve_envelope(envelope, sr, values, status=None, stats=None, events=False, frame_offset=0):
+    # envelope: keying envelope of the carrier mapped to [0, 1], one value per stft frame
+    # stats: optional dict that receives the timings found, in seconds, and their spread. the timings are also given
+    # in frames (dot_frames, ...), the ones to take ratios of: frames_to_time adds an offset of n_fft // 2 samples
+    # events: return a Keying of the marks found instead of the code string, frame_offset: stft frame of the first
+    # envelope value
+    status = [] if status is None else status
+    stats = {} if stats is None else stats
 
-    # if value did not fell at the end, we need to add the falling edge at the end
-    if rising_idx[-1] > falling_idx[-1]:
-        falling_idx = np.insert(falling_idx, len(falling_idx), len(binary_data) - 1)
+    # ----------------------------------- Find The Positions Of Rising And Falling ----------------------------------- #
+    binary_data = np.where(envelope > ENVELOPE_THRESHOLD, 1, 0)
+    # find the differences between consecutive values to find the rising and falling. the data is padded with a low
+    # value at both ends: a signal that is high at the beginning rises at -1 and one still high at the end falls at
+    # the last frame
+    diff = np.diff(binary_data, prepend=0, append=0)
+    rising_idx = np.nonzero(diff == 1)[0] - 1
+    falling_idx = np.nonzero(diff == -1)[0] - 1
 
     on_frames = falling_idx - rising_idx  # the number of samples between rising and falling
     off_frames = rising_idx[1:] - falling_idx[:len(falling_idx)-1]  # the number of samples btwn falling and rising
+    profiling.record(frames=len(envelope), edges=len(rising_idx) + len(falling_idx), on_frames=on_frames,
+                     off_frames=off_frames)
 
     # ------------------------------------------------- Find Symbols ------------------------------------------------- #
     if len(on_frames) == 0:
         status.append('!Could not found any dash/dot symbols!')
-        return '', ' | '.join(status)
+        return (Keying(np.empty(0, dtype=EVENT_DTYPE), sr, values) if events else ''), ' | '.join(status)
 
     # separate symbols into dot and dash
-    symbol_cluster = sklearn.cluster.KMeans(2).fit(on_frames.reshape(-1, 1))
-
-    sorted_label_idx = np.argsort(symbol_cluster.cluster_centers_.flatten())
-    dot_label = sorted_label_idx[0]
-    dash_label = sorted_label_idx[1]
-    status.append('Dot: {:.0f} ms, Dash: {:.0f} ms'.format(
-        1000*frames_to_time(symbol_cluster.cluster_centers_.flatten()[dot_label], sr, values),
-        1000*frames_to_time(symbol_cluster.cluster_centers_.flatten()[dash_label], sr, values)))
-
-    # extract symbols
-    symbols = ['.' if i == dot_label else '-' for i in symbol_cluster.labels_]
+    ratios = TIMING_RATIOS if values['fixed_ratios'] else None
+    symbol_centers, symbol_labels = cluster_1d(on_frames, 2, ratios)
+    profiling.record(symbol_centers=symbol_centers)
+    stats['dot'] = frames_to_time(symbol_centers[0], sr, values)
+    stats['dash'] = frames_to_time(symbol_centers[1], sr, values)
+    stats['dot_frames'], stats['dash_frames'] = float(symbol_centers[0]), float(symbol_centers[1])
+    status.append('Dot: {:.0f} ms, Dash: {:.0f} ms'.format(1000*stats['dot'], 1000*stats['dash']))
 
     # ------------------------------------------------- Find Spacings ------------------------------------------------ #
     if len(off_frames) == 0:
         status.append('!Could not find spacing between symbols!')
-        return '', ' | '.join(status)
+        return (Keying(np.empty(0, dtype=EVENT_DTYPE), sr, values) if events else ''), ' | '.join(status)
 
     # separate spacings into symbol, letter, and word lengths
-    spacing_cluster = sklearn.cluster.KMeans(3).fit(off_frames.reshape(-1, 1))
-
-    sorted_label_idx = np.argsort(spacing_cluster.cluster_centers_.flatten())
-    symbol_spacing = sorted_label_idx[0]
-    letter_spacing = sorted_label_idx[1]
-    word_spacing = sorted_label_idx[2]
-
-    # break into symbols
-    symbol_break_idx = np.flatnonzero(spacing_cluster.labels_ != symbol_spacing) + 1
-    remaining_spacings = spacing_cluster.labels_[spacing_cluster.labels_ != symbol_spacing]
-    # break into words
-    word_break_idx = np.flatnonzero(remaining_spacings == word_spacing) + 1
-
+    spacing_centers, spacing_labels = cluster_1d(off_frames, 3, ratios)
+    profiling.record(spacing_centers=spacing_centers)
+    symbol_spacing, letter_spacing, word_spacing = codec.SYMBOL_SPACING, codec.LETTER_SPACING, codec.WORD_SPACING
+
+    # mean distance of the durations to their cluster centers, relative to the center: small for keyed morse and
+    # large for noise, which has no distinct durations
+    stats['timing_spread'] = float(np.mean(np.concatenate((
+        np.abs(on_frames - symbol_centers[symbol_labels]) / symbol_centers[symbol_labels],
+        np.abs(off_frames - spacing_centers[spacing_labels]) / spacing_centers[spacing_labels]))))
+    stats['symbol_spacing'] = frames_to_time(spacing_centers[symbol_spacing], sr, values)
+    stats['letter_spacing'] = frames_to_time(spacing_centers[letter_spacing], sr, values)
+    stats['word_spacing'] = frames_to_time(spacing_centers[word_spacing], sr, values)
+    for name, label in (('symbol_spacing', symbol_spacing), ('letter_spacing', letter_spacing),
+                        ('word_spacing', word_spacing)):
+        stats[f'{name}_frames'] = float(spacing_centers[label])
     status.append('Symbol spacing: {:.0f} ms, Letter spacing: {:.0f} ms, Word spacing: {:.0f} ms'.format(
-        1000*frames_to_time(spacing_cluster.cluster_centers_.flatten()[symbol_spacing], sr, values),
-        1000*frames_to_time(spacing_cluster.cluster_centers_.flatten()[letter_spacing], sr, values),
-        1000*frames_to_time(spacing_cluster.cluster_centers_.flatten()[word_spacing], sr, values)))
+        1000*stats['symbol_spacing'], 1000*stats['letter_spacing'], 1000*stats['word_spacing']))
 
     # --------------------------------------------------- Find Code -------------------------------------------------- #
-    symbol_start_idx = [0] + symbol_break_idx.tolist()
-    symbol_end_idx = symbol_break_idx.tolist() + [len(symbols)]
-    letters = ["".join(symbols[i:j]) for i, j in zip(symbol_start_idx, symbol_end_idx)]
-
-    word_start_idx = [0] + (word_break_idx).tolist()
-    word_end_idx = (word_break_idx).tolist() + [len(letters)]
-    words = [" ".join(letters[i:j]) for i, j in zip(word_start_idx, word_end_idx)]
-
-    return '/'.join(words), ' | '.join(status)
-
-
+    # the cluster labels are ordered like the codec's: dot, dash and symbol, letter, word spacing
+    if events:
+        # marks run from the first keyed frame to the first unkeyed one
+        keying = Keying.from_labels(rising_idx + 1, falling_idx + 1, symbol_labels, spacing_labels, sr, values,
+                                    frame_offset)
+        return keying, ' | '.join(status)
+    return codec.encode_code(symbol_labels, spacing_labels), ' | '.join(status)
+
+
+# ------------------------------------------------ Multiple Carriers ------------------------------------------------- #
+
+def find_carriers(dft, prominence=3.5):
+    # bins that stand out of the mean spectrum by at least `prominence` dB, strongest first
+    import scipy.signal
+    peaks, properties = scipy.signal.find_peaks(np.mean(dft, axis=1), prominence=prominence)
+    return peaks[np.argsort(properties['prominences'])[::-1]]
+
+
+def _solve_carrier_row(args):
+    row, floor, sr, values = args
+    # every carrier is mapped to [0, 1] against its own peak, so weaker stations are not lost under the threshold
+    envelope = np.interp(row, [floor, np.amax(row)], [0, 1])
+    stats = {}
+    code, _ = solve_envelope(envelope, sr, values, stats=stats)
+    return code, stats
+
+
+@profiling.traced('solve_carriers')
+def solve_carriers(dft, sr, values, prominence=3.5, processes=1):
+    # decode every keyed carrier of the spectrogram, returns a list of (frequency, code, text, timing stats).
+    # processes > 1 (None: one per core) solves the carriers in worker processes, only once their envelopes together
+    # are long enough to pay for the workers, see PARALLEL_SEGMENT_FRAMES
+    carriers = np.sort(find_carriers(dft, prominence))
+    profiling.record(carriers=len(carriers))
+    floor = np.amin(dft)
+    jobs = [(dft[i], floor, sr, values) for i in carriers]
+    processes = os.cpu_count() if processes is None else processes
+    if processes > 1 and len(jobs) > 1 and len(jobs) * dft.shape[1] > PARALLEL_SEGMENT_FRAMES:
+        with concurrent.futures.ProcessPoolExecutor(min(processes, len(jobs))) as executor:
+            results = list(executor.map(_solve_carrier_row, jobs))
+    else:
+        results = [_solve_carrier_row(job) for job in jobs]
+    return [(bin_to_freq(i, sr, values), code, decode(code).strip(), stats)
+            for i, (code, stats) in zip(carriers, results)]
+
+
+# ------------------------------------------------- Segmented Solve ------------------------------------------------- #
+# long recordings where operators at different speeds take turns are split at long silences into transmissions, each
+# solved with its own timing clusters
+
+SEGMENT_SILENCE = 3.0  # seconds, well beyond a word spacing even at 5 wpm
+# a transmission (or a carrier) solves in milliseconds, worker processes only pay off on envelopes of hours
+PARALLEL_SEGMENT_FRAMES = 1 << 22
+
+
+def split_envelope(envelope, sr, values, min_silence=SEGMENT_SILENCE):
+    # frame ranges [start, stop) of the transmissions in an envelope, split in the middle of every silence of at least
+    # min_silence seconds
+    diff = np.diff(np.where(envelope > ENVELOPE_THRESHOLD, 1, 0), prepend=0, append=0)
+    rising_idx = np.nonzero(diff == 1)[0]
+    falling_idx = np.nonzero(diff == -1)[0]
+    gaps = rising_idx[1:] - falling_idx[:-1]
+    cuts = np.nonzero(gaps >= min_silence * sr / int(values['hop_length']))[0]
+    bounds = np.concatenate(([0], (falling_idx[cuts] + rising_idx[cuts + 1]) // 2, [len(envelope)]))
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _solve_segment(args):
+    envelope, sr, values = args
+    stats = {}
+    code, _ = solve_envelope(envelope, sr, values, stats=stats)
+    return code, stats
+
+
+@profiling.traced('solve_segments')
+def solve_segments(dft, sr, values, freq_offset=0, value_range=None, carrier=None, stats=None, frame_offset=0,
+                   min_silence=SEGMENT_SILENCE, processes=1):
+    # like solve, but every transmission of the dominant frequency gets its own timing clusters. returns the code of
+    # all transmissions with a word spacing between them, the status, and a list of {'start', 'end' (seconds from the
+    # start of the file), 'code', 'text', 'stats'} per transmission. processes > 1 (None: one per core) solves the
+    # transmissions of a long envelope in worker processes
+    status = []
+    envelope = dominant_envelope(dft, sr, values, freq_offset, value_range, carrier, status, stats)
+    segments = split_envelope(envelope, sr, values, min_silence)
+    profiling.record(segments=len(segments))
+    jobs = [(envelope[start:stop], sr, values) for start, stop in segments]
+    processes = os.cpu_count() if processes is None else processes
+    if processes > 1 and len(jobs) > 1 and len(envelope) > PARALLEL_SEGMENT_FRAMES:
+        with concurrent.futures.ProcessPoolExecutor(min(processes, len(jobs))) as executor:
+            results = list(executor.map(_solve_segment, jobs))
+    else:
+        results = [_solve_segment(job) for job in jobs]
+
+    transmissions = [{'start': float(frames_to_time(frame_offset + start, sr, values)),
+                      'end': float(frames_to_time(frame_offset + stop, sr, values)),
+                      'code': code, 'text': decode(code).strip(), 'stats': segment_stats}
+                     for (start, stop), (code, segment_stats) in zip(segments, results)]
+    status.append('{} transmissions, split at {:.1f} s of silence'.format(len(segments), min_silence))
+    return '/'.join(code for code, _ in results if code), ' | '.join(status), transmissions
+
+
+@profiling.traced('decode')
 def decode(encoded):
     code = encoded.strip()
     if code == '':
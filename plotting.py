@@ -1,22 +1,15 @@
 import matplotlib.pyplot as plt
 import numpy as np
 
+import profiling
 from util import fft_frequencies, frames_to_time, get_domains
 
 
-def plot(dft, sr, values):
-    fig, ax = plt.subplots()
-    img = ax.imshow(dft, aspect='auto', origin='lower', interpolation="none")
-    fig.colorbar(img, ax=ax, format="%+2.f dB")
-    ax.set_title('Spectrogram')
+def set_axes(ax, shape, sr, values, time_domain, freq_domain):
     ax.grid(values['plot_grids'])
-    plt.subplots_adjust(left=0.1, right=1.05, top=0.95, bottom=0.15)
-
-    boundaries = (values['plot_time_min'], values['plot_time_max'], values['plot_freq_min'], values['plot_freq_max'])
-    time_domain, freq_domain = get_domains(dft.shape, sr, boundaries, values)
 
     # Handle time axis
-    frame_times = frames_to_time(np.arange(dft.shape[1]), sr, values)
+    frame_times = frames_to_time(np.arange(shape[1]), sr, values)
     x_ticks = np.linspace(time_domain[0], time_domain[1], 15, endpoint=False).astype(int)
     x_ticks_labels = [f"{x:.2f}" for x in frame_times[x_ticks]]
     ax.set_xticks(x_ticks)
@@ -33,4 +26,76 @@ def plot(dft, sr, values):
     ax.set_ylabel('Frequency (Hz)')
     ax.set_ylim(freq_domain)
 
-    return fig, ax
+
+# ------------------------------------------------ Level Of Detail ------------------------------------------------- #
+
+@profiling.traced('build_pyramid')
+def build_pyramid(dft, min_columns=256):
+    # level k holds the maximum over 2**k frames per column: short dots stay visible however far it is zoomed out
+    pyramid = [dft]
+    while pyramid[-1].shape[1] > min_columns:
+        level = pyramid[-1]
+        if level.shape[1] % 2:
+            level = np.concatenate((level, level[:, -1:]), axis=1)
+        pyramid.append(np.maximum(level[:, 0::2], level[:, 1::2]))
+    return pyramid
+
+
+class SpectrogramRenderer:
+    # one figure for the lifetime of the window, redrawn with set_data/set_extent from the pyramid level that has
+    # about as many columns as the axes has pixels, so redrawing depends on the visible area, not the file length
+
+    def __init__(self):
+        self.fig, self.ax = plt.subplots()
+        plt.subplots_adjust(left=0.1, right=1.05, top=0.95, bottom=0.15)
+        self.ax.set_title('Spectrogram')
+        self.img = None
+        self.pipeline = None
+        self.sr = None
+        self.values = None
+        self._source = None
+        self._pyramid = None
+
+    def draw(self, pipeline, sr, values):
+        return self.show(self.prepare(pipeline, sr, values))
+
+    @profiling.traced('plot')
+    def prepare(self, pipeline, sr, values):
+        # the numpy part of a redraw, it does not touch the figure so it can run off the GUI thread
+        if pipeline.dft is self._source:
+            pyramid = self._pyramid
+        else:
+            pyramid = build_pyramid(pipeline.dft)
+
+        boundaries = (values['plot_time_min'], values['plot_time_max'], values['plot_freq_min'], values['plot_freq_max'])
+        time_domain, freq_domain = get_domains(pipeline.shape, sr, boundaries, values)
+
+        # coarsest level that still has at least one column per pixel in the visible window
+        max_columns = max(1, int(self.ax.bbox.width))
+        level = 0
+        while level + 1 < len(pyramid) and (time_domain[1] - time_domain[0]) >> (level + 1) >= max_columns:
+            level += 1
+        step = 1 << level
+        col_min, col_max = time_domain[0] // step, -(-time_domain[1] // step)
+        data = np.array(pyramid[level][freq_domain[0]:freq_domain[1], col_min:col_max])
+        data = pipeline.apply_filters(data, col_min, freq_domain[0], step)
+        extent = (col_min * step - 0.5, col_max * step - 0.5, freq_domain[0] - 0.5, freq_domain[1] - 0.5)
+
+        return {'pipeline': pipeline, 'pyramid': pyramid, 'sr': sr, 'values': values, 'data': data, 'extent': extent,
+                'time_domain': time_domain, 'freq_domain': freq_domain}
+
+    def show(self, frame):
+        # put a prepared frame on the figure, GUI thread only
+        self.pipeline, self.sr, self.values = frame['pipeline'], frame['sr'], frame['values']
+        self._source, self._pyramid = frame['pipeline'].dft, frame['pyramid']
+        data = frame['data']
+        if self.img is None:
+            self.img = self.ax.imshow(data, aspect='auto', origin='lower', interpolation="none", extent=frame['extent'])
+            self.fig.colorbar(self.img, ax=self.ax, format="%+2.f dB")
+        else:
+            self.img.set_data(data)
+            self.img.set_extent(frame['extent'])
+            if data.size:
+                self.img.set_clim(np.min(data), np.max(data))
+        set_axes(self.ax, self.pipeline.shape, frame['sr'], self.values, frame['time_domain'], frame['freq_domain'])
+        return self.fig, self.ax
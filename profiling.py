@@ -0,0 +1,186 @@
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+# Opt-in instrumentation of the decoding stages. Functions marked with @traced record their wall time, CPU time, peak
+# allocation and result sizes, and record() attaches intermediate counts to the stage it is called from. Nothing is
+# recorded, and the hooks do no more than a None check, unless a Tracer has been started.
+
+_tracer = None
+
+
+def start(tracer=None):
+    global _tracer
+    _tracer = Tracer() if tracer is None else tracer
+    _tracer.open()
+    return _tracer
+
+
+def stop():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+    return tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.stage(name) as stage:
+                result = func(*args, **kwargs)
+                stage['result'] = describe(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def record(**counts):
+    # counts of the stage that is running on this thread, e.g. record(edges=len(rising_idx))
+    tracer = _tracer
+    if tracer is not None:
+        tracer.record(counts)
+
+
+def describe(value):
+    # a JSON friendly summary: small arrays are listed, larger ones summarized by their size, and by their range as
+    # long as that is cheap to find (on/off durations, not spectrograms)
+    if isinstance(value, np.ndarray):
+        if value.size <= 16:
+            return value.tolist()
+        summary = {'shape': list(value.shape), 'dtype': str(value.dtype), 'nbytes': int(value.nbytes)}
+        if value.dtype.kind in 'iuf' and value.size <= 1 << 16:
+            summary.update(min=float(np.min(value)), max=float(np.max(value)), mean=float(np.mean(value)))
+        return summary
+    if isinstance(value, (tuple, list)):
+        return [describe(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): describe(v) for k, v in value.items()}
+    if isinstance(value, str):
+        return value if len(value) <= 64 else {'len': len(value)}
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return type(value).__name__
+
+
+class Tracer:
+    # keeps every finished stage as a dict, and writes it as a JSON line to `out` if given. `tags` are added to every
+    # record, e.g. the file being decoded.
+
+    def __init__(self, out=None, memory=True, **tags):
+        self.out = out
+        self.memory = memory
+        self.tags = tags
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+
+    def open(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def close(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, counts):
+        stack = self._stack()
+        if stack:
+            stack[-1].record.setdefault('counts', {}).update(describe(counts))
+        else:
+            self.add(dict(stage=None, counts=describe(counts)))
+
+    def add(self, record):
+        record.update(self.tags)
+        with self._lock:
+            self.records.append(record)
+            if self.out is not None:
+                self.out.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        # total time and largest peak per stage name, in the order the stages first finished
+        totals = {}
+        for record in self.records:
+            if record.get('stage') is None:
+                continue
+            total = totals.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_bytes': 0})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['peak_bytes'] = max(total['peak_bytes'], record.get('peak_bytes', 0))
+        return totals
+
+    def format_summary(self, counts=True):
+        lines = [f"{'stage':<16}{'calls':>6}{'wall (ms)':>11}{'cpu (ms)':>10}{'peak (MB)':>11}"]
+        for name, total in self.summary().items():
+            lines.append(f"{name:<16}{total['calls']:>6}{1000 * total['wall']:>11.1f}{1000 * total['cpu']:>10.1f}"
+                         f"{total['peak_bytes'] / 1e6:>11.1f}")
+        for record in self.records if counts else []:
+            if record.get('counts'):
+                lines.append(f"{record['stage'] or '-'}: {json.dumps(record['counts'])}")
+        return '\n'.join(lines)
+
+
+class _Stage:
+    # a traced call. the tracemalloc peak is global, so it is reset for every stage and the running peak is handed
+    # back to the enclosing stage when it ends
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.record = {'stage': name}
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.record['depth'] = len(stack)
+        if stack:
+            self.record['parent'] = stack[-1].record['stage']
+        self._memory = self.tracer.memory and tracemalloc.is_tracing()
+        if self._memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            tracemalloc.reset_peak()
+            self._start_bytes, self._peak = current, current
+        stack.append(self)
+        self._wall, self._cpu = time.perf_counter(), time.thread_time()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record['wall'] = time.perf_counter() - self._wall
+        self.record['cpu'] = time.thread_time() - self._cpu
+        stack = self.tracer._stack()
+        stack.pop()
+        if self._memory:
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            self.record['peak_bytes'] = self._peak - self._start_bytes
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, self._peak)
+        if exc_type is not None:
+            self.record['error'] = f"{exc_type.__name__}: {exc}"
+        self.tracer.add(self.record)
+        return False
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import morse
+from batch import find_files
+from server import parse_address
+
+# Stand-in for the receivers: plays WAV files into server.py as raw s16le streams, at real time or faster, and
+# optionally subscribes to the decoded text. e.g.
+#   python server.py --tcp 7355 -q &
+#   python replay.py examples --tcp 7355 --speed 4 --copies 10 --subscribe
+
+
+async def connect(args):
+    if args.unix is not None:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(*parse_address(args.tcp))
+
+
+async def send_file(args, filename, name):
+    y, sr = morse.load_file(filename)
+    pcm = (np.clip(y, -1, 1) * 32767).astype('<i2').tobytes()
+    reader, writer = await connect(args)
+    header = {'role': 'source', 'name': name, 'sr': int(sr), 'format': 's16le', 'channels': 1, 'final': True}
+    writer.write((json.dumps(header) + '\n').encode())
+
+    chunk = max(1, int(args.chunk * sr)) * 2
+    started = time.perf_counter()
+    for i, start in enumerate(range(0, len(pcm), chunk)):
+        writer.write(pcm[start:start + chunk])
+        # drain waits while the server is not reading, i.e. while its buffers for this stream are full
+        await writer.drain()
+        if args.speed > 0:
+            delay = started + (i + 1) * args.chunk / args.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    writer.write_eof()
+    # the server closes the connection once the stream is decoded
+    await reader.read()
+    writer.close()
+    return len(y) / sr
+
+
+async def subscribe(args, names, ready):
+    reader, writer = await connect(args)
+    writer.write((json.dumps({'role': 'subscribe', 'streams': sorted(names)}) + '\n').encode())
+    await writer.drain()
+    ready.set()
+    pending = set(names)
+    while pending:
+        line = await reader.readline()
+        if not line:
+            break
+        message = json.loads(line)
+        if message.get('event') == 'end':
+            pending.discard(message['stream'])
+        print(json.dumps(message, ensure_ascii=False), flush=True)
+    writer.close()
+
+
+async def replay(args):
+    files = find_files(args.paths)
+    jobs = [(filename, f"{os.path.basename(filename)}#{copy}") for copy in range(args.copies) for filename in files]
+    ready = asyncio.Event()
+    listener = None
+    if args.subscribe:
+        listener = asyncio.ensure_future(subscribe(args, {name for _, name in jobs}, ready))
+        await ready.wait()
+
+    started = time.perf_counter()
+    audio_seconds = await asyncio.gather(*(send_file(args, filename, name) for filename, name in jobs))
+    elapsed = time.perf_counter() - started
+    if listener is not None:
+        await listener
+    print(f"{len(jobs)} streams, {sum(audio_seconds):.1f} s of audio in {elapsed:.2f} s "
+          f"({sum(audio_seconds) / elapsed:.1f}x real time)", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay WAV files into server.py as live PCM streams.')
+    parser.add_argument('paths', nargs='+', help='WAV files, directories or glob patterns')
+    parser.add_argument('--tcp', metavar='[HOST:]PORT', default='7355', help='server address')
+    parser.add_argument('--unix', metavar='PATH', help='server Unix socket, instead of TCP')
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed, 0 for as fast as the server reads')
+    parser.add_argument('--chunk', type=float, default=0.1, help='seconds of audio per write')
+    parser.add_argument('--copies', type=int, default=1, help='concurrent streams per file')
+    parser.add_argument('--subscribe', action='store_true', help='print the decoded text as it is published')
+    asyncio.run(replay(parser.parse_args(argv)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from batch import parse_values
+from morse import decode
+from streaming import StreamingDecoder
+
+# Every connection starts with one JSON line. A source declares its audio and then sends raw PCM until it closes:
+#   {"role": "source", "name": "rx1", "sr": 48000, "format": "s16le", "channels": 1, "carrier": null, "final": false}
+# with "final", for a recording of finite length, the end message has the whole stream solved at once
+# A subscriber names the streams it wants (all of them if none) and then receives JSON lines as text is decoded:
+#   {"role": "subscribe", "streams": ["rx1"]}
+#   {"stream": "rx1", "event": "text", "text": "CQ CQ", "time": 12.3}
+
+# sample format -> (numpy dtype, offset, full scale)
+FORMATS = {'u8': ('u1', 128, 128), 's16le': ('<i2', 0, 32768), 's32le': ('<i4', 0, 2 ** 31), 'f32le': ('<f4', 0, 1)}
+
+
+class Stream:
+    # one decoding session. chunks go through a bounded queue to a single consumer, so a stream that decodes slower
+    # than it arrives stops being read and the sender is held back by the socket instead of filling memory
+
+    def __init__(self, server, name, sr, fmt, channels, carrier, final=False):
+        self.server = server
+        self.name = name
+        self.sr = sr
+        self.dtype, self.offset, self.scale = FORMATS[fmt]
+        self.frame_bytes = np.dtype(self.dtype).itemsize * channels
+        self.channels = channels
+        # the rows for the final solve grow with the stream, so only a stream that ends keeps them
+        self.decoder = StreamingDecoder(sr, server.values, carrier, keep_rows=final)
+        self.queue = asyncio.Queue(server.queue_chunks)
+        self.samples = 0
+        self._remainder = b''
+        self._code_pos = 0
+
+    def to_samples(self, data):
+        # whole frames only, a partial one is kept for the next read
+        data = self._remainder + data
+        usable = len(data) - len(data) % self.frame_bytes
+        self._remainder = data[usable:]
+        samples = (np.frombuffer(data[:usable], dtype=self.dtype).astype(np.float32) - self.offset) / self.scale
+        return samples.reshape(-1, self.channels) if self.channels > 1 else samples
+
+    def take_text(self):
+        # text of the letters completed since the last call. the decoder emits whole letters, and the separator before
+        # a letter when it starts, so a trailing separator waits for its letter
+        head = self.decoder.live_code[self._code_pos:].rstrip(' /')
+        if not head:
+            return ''
+        self._code_pos += len(head)
+        body = head.lstrip(' /')
+        lead = ' ' if head[:len(head) - len(body)].endswith('/') else ''
+        return lead + decode(body).rstrip(' ')
+
+    async def read(self, reader):
+        # the stream ends when the source closes or drops
+        size = self.server.chunk_bytes(self)
+        try:
+            while True:
+                await self.queue.put(await reader.readexactly(size))
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                await self.queue.put(e.partial)
+        except ConnectionError:
+            pass
+        await self.queue.put(None)
+
+    async def decode(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                break
+            samples = self.to_samples(data)
+            self.samples += len(samples)
+            # the numpy/scipy work runs on the executor, the event loop only moves bytes
+            if await loop.run_in_executor(None, self.decoder.feed_audio, samples):
+                self.publish_text()
+        await loop.run_in_executor(None, self.decoder.flush)
+        self.publish_text()
+
+    def publish_text(self):
+        text = self.take_text()
+        if text:
+            self.server.publish({'stream': self.name, 'event': 'text', 'text': text, 'time': self.samples / self.sr})
+
+
+class Server:
+    def __init__(self, values, chunk_seconds=0.25, queue_chunks=8, subscriber_messages=1024, echo=True):
+        self.values = values
+        self.chunk_seconds = chunk_seconds
+        self.queue_chunks = queue_chunks
+        self.subscriber_messages = subscriber_messages
+        self.echo = echo
+        self.streams = {}
+        self.subscribers = {}
+        self._next_id = 0
+
+    def chunk_bytes(self, stream):
+        return max(1, int(self.chunk_seconds * stream.sr)) * stream.frame_bytes
+
+    # -------------------------------------------------- Publishing -------------------------------------------------- #
+
+    def publish(self, message):
+        if self.echo:
+            print(json.dumps(message, ensure_ascii=False), flush=True)
+        for queue, names in list(self.subscribers.items()):
+            if names and message['stream'] not in names:
+                continue
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # a subscriber that does not keep up is dropped rather than holding back the decoders, it still gets
+                # what is queued
+                del self.subscribers[queue]
+
+    async def subscribe(self, header, writer):
+        queue = asyncio.Queue(self.subscriber_messages)
+        self.subscribers[queue] = set(header.get('streams') or [])
+        try:
+            while queue in self.subscribers or not queue.empty():
+                message = await queue.get()
+                if writer.is_closing():
+                    break
+                writer.write((json.dumps(message, ensure_ascii=False) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.pop(queue, None)
+
+    # --------------------------------------------------- Sources ---------------------------------------------------- #
+
+    def open_stream(self, header):
+        name = str(header.get('name') or f"stream-{self._next_id}")
+        self._next_id += 1
+        if name in self.streams:
+            raise ValueError(f"Stream {name} is already open")
+        fmt = header.get('format', 's16le')
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {fmt}, expected one of {', '.join(FORMATS)}")
+        carrier = header.get('carrier')
+        stream = Stream(self, name, int(header['sr']), fmt, int(header.get('channels', 1)),
+                        None if carrier is None else float(carrier), bool(header.get('final', False)))
+        self.streams[name] = stream
+        return stream
+
+    async def run_stream(self, stream, reader):
+        self.publish({'stream': stream.name, 'event': 'start', 'sr': stream.sr})
+        started = time.perf_counter()
+        reading = asyncio.ensure_future(stream.read(reader))
+        try:
+            await stream.decode()
+        finally:
+            reading.cancel()
+            del self.streams[stream.name]
+        audio_seconds = stream.samples / stream.sr
+        self.publish({'stream': stream.name, 'event': 'end', 'text': stream.decoder.text.strip(),
+                      'code': stream.decoder.code, 'audio_seconds': audio_seconds,
+                      'wall_seconds': time.perf_counter() - started})
+
+    async def handle(self, reader, writer):
+        try:
+            header = json.loads(await reader.readuntil(b'\n'))
+            if header.get('role') == 'subscribe':
+                await self.subscribe(header, writer)
+            else:
+                await self.run_stream(self.open_stream(header), reader)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except (ValueError, KeyError) as e:
+            writer.write((json.dumps({'event': 'error', 'error': f"{type(e).__name__}: {e}"}) + '\n').encode())
+        finally:
+            writer.close()
+
+    async def read_stdin(self, header):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+        await self.run_stream(self.open_stream(header), reader)
+
+
+# ------------------------------------------------------ Driver ------------------------------------------------------ #
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+async def serve(args):
+    server = Server(parse_values(args.params, args.set), args.chunk, args.queue, echo=not args.quiet)
+    listeners = []
+    if args.tcp is not None:
+        host, port = parse_address(args.tcp)
+        listeners.append(await asyncio.start_server(server.handle, host, port))
+    if args.unix is not None:
+        listeners.append(await asyncio.start_unix_server(server.handle, args.unix))
+    for listener in listeners:
+        for sock in listener.sockets:
+            print(f"Listening on {sock.getsockname()}", file=sys.stderr)
+
+    if args.stdin:
+        header = {'name': args.name or 'stdin', 'sr': args.sr, 'format': args.format, 'channels': args.channels,
+                  'carrier': args.carrier, 'final': args.final}
+        await server.read_stdin(header)
+        if not listeners:
+            return
+    await asyncio.gather(*(listener.serve_forever() for listener in listeners))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode live raw PCM streams and publish the text as it comes.')
+    parser.add_argument('--tcp', metavar='[HOST:]PORT', help='listen for sources and subscribers on TCP')
+    parser.add_argument('--unix', metavar='PATH', help='listen for sources and subscribers on a Unix socket')
+    parser.add_argument('--stdin', action='store_true', help='decode one stream from stdin')
+    parser.add_argument('--name', help='name of the stdin stream')
+    parser.add_argument('--sr', type=int, default=48000, help='sample rate of the stdin stream')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='s16le', help='sample format of the stdin stream')
+    parser.add_argument('--channels', type=int, default=1, help='interleaved channels of the stdin stream')
+    parser.add_argument('--carrier', type=float, help='carrier frequency of the stdin stream (default: estimated)')
+    parser.add_argument('--final', action='store_true',
+                        help='solve the whole stdin stream at once at its end, for a recording of finite length')
+    parser.add_argument('-p', '--params', help='JSON file with parameter values in the form of config.DEFAULTS')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a single parameter, e.g. -s hop_length=128')
+    parser.add_argument('--chunk', type=float, default=0.25, help='seconds of audio read per chunk')
+    parser.add_argument('--queue', type=int, default=8, help='chunks buffered per stream before reading pauses')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not echo the published messages to stdout')
+    args = parser.parse_args(argv)
+    if args.tcp is None and args.unix is None and not args.stdin:
+        parser.error('nothing to listen on, give --tcp, --unix or --stdin')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
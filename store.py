@@ -0,0 +1,321 @@
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+import morse
+from batch import find_files, parse_values
+from cache import SpectrogramCache, hash_file
+
+# Decoded results of an archive of WAV files, kept in SQLite so a re-run only decodes what changed. A file is known by
+# its content hash (hashed again only when its size or mtime change), a result by that hash and the parameters the
+# decode depends on. Spectrograms are kept on disk next to the database, so a change to a filter or to the solver
+# reuses the stored spectrogram and only runs the stages after it. e.g.
+#   python store.py reprocess examples -d results.db -s apply_threshold_db=true -s threshold_db=-30
+#   python store.py query -d results.db --carrier 700 --text CQ
+
+# the parameters each stage reads, in order. a result is redone when any of them changes, and its spectrogram is
+# reused unless one of the stft ones did
+STAGE_PARAMS = {
+    'stft': ('n_fft', 'win_length', 'hop_length'),
+    'filters': ('apply_threshold_db', 'threshold_db', 'apply_freq_band', 'freq_band_min', 'freq_band_max',
+                'apply_time_band', 'time_band_min', 'time_band_max'),
+    'solve': ('fixed_ratios',),
+}
+# a filter's own parameters only matter while it is applied
+FILTER_FLAGS = {
+    'threshold_db': 'apply_threshold_db',
+    'freq_band_min': 'apply_freq_band',
+    'freq_band_max': 'apply_freq_band',
+    'time_band_min': 'apply_time_band',
+    'time_band_max': 'apply_time_band',
+}
+STATS = ('carrier', 'dot', 'dash', 'symbol_spacing', 'letter_spacing', 'word_spacing', 'timing_spread')
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    file_hash TEXT NOT NULL,
+    sr INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_file_hash ON files (file_hash);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    file_hash TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sr INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    {', '.join(f'{name} REAL' for name in STATS)},
+    decoded_at REAL NOT NULL,
+    decode_seconds REAL NOT NULL,
+    UNIQUE (file_hash, params_hash)
+);
+CREATE INDEX IF NOT EXISTS results_params_hash ON results (params_hash);
+CREATE INDEX IF NOT EXISTS results_decoded_at ON results (decoded_at);
+CREATE INDEX IF NOT EXISTS results_carrier ON results (carrier);
+"""
+
+
+# ------------------------------------------------- Helper Functions ------------------------------------------------- #
+
+def relevant_params(values, auto_band=False):
+    # the parameters a decode depends on, with those of the filters that are not applied left out
+    params = {'auto_band': bool(auto_band)}
+    for keys in STAGE_PARAMS.values():
+        for key in keys:
+            if key not in FILTER_FLAGS or values[FILTER_FLAGS[key]]:
+                params[key] = values[key]
+    return params
+
+
+def hash_params(params):
+    digest = hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=16)
+    return digest.hexdigest()
+
+
+def parse_date(text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+# ------------------------------------------------------- Store ------------------------------------------------------ #
+
+class ResultsStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def file_info(self, path):
+        # (file hash, sample rate, duration) of a WAV file, read from the store unless the file changed
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.connection.execute('SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+        if row is not None and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+            return row['file_hash'], row['sr'], row['duration']
+        y, sr = morse.load_file_mmap(path)
+        info = hash_file(path), int(sr), len(y) / sr
+        del y
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                    (path, stat.st_size, stat.st_mtime) + info)
+        return info
+
+    def has_result(self, file_hash, params_hash):
+        row = self.connection.execute('SELECT 1 FROM results WHERE file_hash = ? AND params_hash = ?',
+                                      (file_hash, params_hash)).fetchone()
+        return row is not None
+
+    def add_result(self, result):
+        stats = result['stats']
+        with self.connection:
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO results (file_hash, params_hash, path, sr, params, ok, code, text, status, "
+                f"{', '.join(STATS)}, decoded_at, decode_seconds) VALUES ({', '.join('?' * (11 + len(STATS)))})",
+                (result['file_hash'], result['params_hash'], result['file'], result['sr'], json.dumps(result['params']),
+                 result['ok'], result['code'], result['text'], result['status'], *(stats.get(name) for name in STATS),
+                 result['decoded_at'], result['decode_seconds']))
+
+    def query(self, since=None, until=None, carrier=None, tolerance=50.0, text=None, limit=None):
+        # results decoded in [since, until) (unix times), with a carrier within tolerance Hz and text containing a
+        # substring, newest first. audio is not touched
+        conditions, args = [], []
+        if since is not None:
+            conditions.append('decoded_at >= ?')
+            args.append(since)
+        if until is not None:
+            conditions.append('decoded_at < ?')
+            args.append(until)
+        if carrier is not None:
+            conditions.append('carrier BETWEEN ? AND ?')
+            args.extend((carrier - tolerance, carrier + tolerance))
+        if text is not None:
+            conditions.append("text LIKE ? ESCAPE '\\'")
+            args.append('%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        sql = 'SELECT * FROM results'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY decoded_at DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(limit)
+        return [self.to_dict(row) for row in self.connection.execute(sql, args)]
+
+    @staticmethod
+    def to_dict(row):
+        result = {key: row[key] for key in ('path', 'file_hash', 'sr', 'code', 'text', 'status') + STATS}
+        result['ok'] = bool(row['ok'])
+        result['params'] = json.loads(row['params'])
+        result['decoded_at'] = datetime.datetime.fromtimestamp(row['decoded_at']).isoformat(timespec='seconds')
+        return result
+
+
+# ----------------------------------------------------- Decoding ----------------------------------------------------- #
+
+_cache = None
+
+
+def _init_worker(directory):
+    # one spectrogram kept in memory per worker, the rest is on disk
+    global _cache
+    _cache = None if directory is None else SpectrogramCache(max_bytes=0, directory=directory)
+
+
+def reprocess_file(args):
+    path, file_hash, sr, values, auto_band = args
+    start = time.perf_counter()
+    stats = {}
+    y = None
+    try:
+        carrier = None
+        if auto_band:
+            y, sr = morse.load_file(path)
+            carrier, _ = morse.estimate_carrier(y, sr, values)
+            band_min, band_max = morse.carrier_band(carrier, sr, values)
+            values = dict(values, apply_freq_band=True, freq_band_min=str(band_min), freq_band_max=str(band_max))
+
+        # the stft runs only if no spectrogram with the same stft parameters is stored for this file
+        key = SpectrogramCache.make_key(file_hash, sr, values)
+        dft = None if _cache is None else _cache.get(key)
+        stft_reused = dft is not None
+        if dft is None:
+            if y is None:
+                y, sr = morse.load_file(path)
+            dft = morse.get_dft(y, sr, values)
+            if _cache is not None:
+                _cache.put(key, dft)
+                _cache.flush()
+        del y
+
+        pipeline = morse.FilterPipeline(dft, sr, values)
+        pipeline.apply(values)
+        code, status = pipeline.solve(values, carrier, stats)
+        result = {'ok': True, 'code': code, 'text': morse.decode(code).strip(), 'status': status}
+    except Exception as e:
+        stft_reused = False
+        result = {'ok': False, 'code': '', 'text': '', 'status': f"{type(e).__name__}: {e}"}
+    result.update(file=path, file_hash=file_hash, sr=sr, stats=stats, stft_reused=stft_reused, decoded_at=time.time(),
+                  decode_seconds=time.perf_counter() - start)
+    return result
+
+
+def reprocess(args):
+    values = parse_values(args.params, args.set)
+    params = relevant_params(values, args.auto_band)
+    params_hash = hash_params(params)
+    spectrograms = None if args.no_spectrograms else args.spectrograms or os.path.splitext(args.db)[0] + '_spectrograms'
+
+    start = time.perf_counter()
+    counts = {'skipped': 0, 'decoded': 0, 'stft_reused': 0, 'failed': 0}
+    with ResultsStore(args.db) as store:
+        jobs = []
+        for path in find_files(args.paths):
+            try:
+                file_hash, sr, _ = store.file_info(path)
+            except Exception as e:
+                # a file that can not be read is reported, not stored, so the next run tries it again
+                counts['failed'] += 1
+                if not args.quiet:
+                    print(json.dumps({'file': os.path.abspath(path), 'ok': False, 'code': '', 'text': '',
+                                      'status': f"{type(e).__name__}: {e}"}, ensure_ascii=False), flush=True)
+                continue
+            if not args.force and store.has_result(file_hash, params_hash):
+                counts['skipped'] += 1
+                continue
+            jobs.append((os.path.abspath(path), file_hash, sr, values, args.auto_band))
+
+        # the core imports scipy lazily, load it once here so forked workers inherit it instead of importing it each
+        import scipy.io.wavfile  # noqa: F401
+        import scipy.signal  # noqa: F401
+
+        with multiprocessing.Pool(max(1, args.jobs), initializer=_init_worker, initargs=(spectrograms,)) as pool:
+            for result in pool.imap_unordered(reprocess_file, jobs):
+                # the full values are stored, the hash covers only the relevant ones
+                result.update(params=values, params_hash=params_hash)
+                store.add_result(result)
+                counts['decoded'] += 1
+                counts['stft_reused'] += result['stft_reused']
+                counts['failed'] += not result['ok']
+                if not args.quiet:
+                    print(json.dumps({key: result[key] for key in ('file', 'ok', 'code', 'text', 'status')},
+                                     ensure_ascii=False), flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"{counts['decoded']} decoded ({counts['stft_reused']} from stored spectrograms, {counts['failed']} failed), "
+          f"{counts['skipped']} unchanged, in {elapsed:.2f} s", file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+
+def query(args):
+    with ResultsStore(args.db) as store:
+        results = store.query(None if args.since is None else parse_date(args.since),
+                              None if args.until is None else parse_date(args.until),
+                              args.carrier, args.tolerance, args.text, args.limit)
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+# ------------------------------------------------------ Driver ------------------------------------------------------ #
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Keep decoded results of WAV files in SQLite and query them.')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-d', '--db', default='results.db', help='SQLite database file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_reprocess = commands.add_parser('reprocess', parents=[common],
+                                           help='decode the files whose content or parameters changed')
+    parser_reprocess.add_argument('paths', nargs='+', help='WAV files, directories or glob patterns')
+    parser_reprocess.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser_reprocess.add_argument('-p', '--params',
+                                  help='JSON file with parameter values in the form of config.DEFAULTS')
+    parser_reprocess.add_argument('-s', '--set', action='append', default=[], metavar='KEY=VALUE',
+                                  help='override a single parameter, e.g. -s threshold_db=-30')
+    parser_reprocess.add_argument('-b', '--auto-band', action='store_true',
+                                  help='filter a band around the estimated carrier frequency before solving')
+    parser_reprocess.add_argument('--spectrograms', metavar='DIR',
+                                  help='where spectrograms are kept (default: next to the database)')
+    parser_reprocess.add_argument('--no-spectrograms', action='store_true', help='do not keep spectrograms')
+    parser_reprocess.add_argument('-f', '--force', action='store_true', help='decode unchanged files as well')
+    parser_reprocess.add_argument('-q', '--quiet', action='store_true', help='do not print the new results')
+    parser_reprocess.set_defaults(func=reprocess)
+
+    parser_query = commands.add_parser('query', parents=[common],
+                                       help='print stored results as JSON lines, newest first')
+    parser_query.add_argument('--since', metavar='DATE', help='decoded at or after, e.g. 2024-05-01 or 2024-05-01T12:00')
+    parser_query.add_argument('--until', metavar='DATE', help='decoded before')
+    parser_query.add_argument('--carrier', type=float, metavar='HZ', help='carrier frequency')
+    parser_query.add_argument('--tolerance', type=float, default=50.0, help='carrier tolerance in Hz')
+    parser_query.add_argument('--text', help='decoded text containing this')
+    parser_query.add_argument('-n', '--limit', type=int, help='at most this many results')
+    parser_query.set_defaults(func=query)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,337 @@
+import numpy as np
+
+from morse import AMIN, TOP_DB, decode, dominant_envelope, get_power, mix_down, power_to_db, solve_envelope
+from util import get_base_freq, get_bin_size
+
+RELOCK_DB = 3.0  # mean dB by which another bin has to overtake the carrier for the decoder to follow it
+HISTORY_FRAMES = 1 << 12  # frames of the candidate rows kept without keep_rows, decoded again on a re-lock
+
+
+class StreamingDecoder:
+    # Decodes morse code from audio or spectrogram chunks as they arrive. Edges are tracked across chunk boundaries
+    # and the dot/dash and spacing centers follow the sender's speed, so letters come out a gap after they end.
+    # live_code is what has been emitted so far. the carrier is first taken from the first frames, then followed by the
+    # mean of every bin over the stream, so leading noise does not hold it. with keep_rows, for finite streams, flush
+    # solves the whole stream the way solve does at the end, and code becomes that result: the rows of the
+    # `candidates` strongest bins are kept for it, a few values per frame, so it equals solve whenever the dominant
+    # frequency is one of them. without it only the last HISTORY_FRAMES of them are, and code stays the live one.
+
+    def __init__(self, sr, values, freq=None, carrier_frames=256, warmup_symbols=8, learning_rate=0.1,
+                 candidates=16, keep_rows=True):
+        self.sr = sr
+        self.values = values
+        self.carrier_frames = carrier_frames
+        self.warmup_symbols = warmup_symbols
+        self.learning_rate = learning_rate
+        self.candidates = candidates
+        self.keep_rows = keep_rows
+        # the nearest row, as solve takes a given carrier
+        self.carrier_bin = None if freq is None else \
+            round((freq - get_base_freq(values)) / get_bin_size(sr, values))
+        self.live_code = ''
+        self.status = ''
+        self._final_code = None
+
+        # stft state, first frame is centered on the first sample just like scipy.signal.stft
+        self._samples = np.zeros(int(values['win_length']) // 2, dtype=np.float32)
+        self._fed_audio = False
+        # dB range seen so far, used the same way solve maps the spectrogram to [0, 1]
+        self._db_max = -np.inf
+        self._db_min = np.inf
+        self._pending_frames = []
+        # per bin sum (clipped as in solve) and peak over the stream, not needed for a given carrier
+        self._carrier_sum = None
+        self._carrier_peak = None
+        self._carrier_count = 0
+
+        # whole stream state for the final solve: the strongest power, the dB range and the candidate rows
+        self._power_max = None
+        self._raw_min = None
+        self._raw_max = None
+        # bin -> [frames before its kept row, its mean over them, chunks of its row since]
+        self._candidate_bins = None if self.carrier_bin is None else np.array([self.carrier_bin])
+        self._rows = {} if self.carrier_bin is None else {self.carrier_bin: [0, 0.0, []]}
+        self._frame_count = 0
+
+        # edge state
+        self._level = None
+        self._run = 0
+        self._seen_on = False
+        self._spaced = False
+
+        # timing state
+        self._events = []
+        self._symbol_centers = None
+        self._spacing_centers = None
+        self._letter = ''
+        self._letters = 0
+        self._separator = ''
+
+    @property
+    def code(self):
+        return self.live_code if self._final_code is None else self._final_code
+
+    @property
+    def text(self):
+        return decode(self.code)
+
+    # ------------------------------------------------------ Input ------------------------------------------------------ #
+
+    def feed_audio(self, chunk):
+        import scipy.signal
+        n_fft = int(self.values['n_fft'])
+        win_length = int(self.values['win_length'])
+        hop_length = int(self.values['hop_length'])
+        self._fed_audio = True
+        self._samples = np.concatenate((self._samples, mix_down(np.asarray(chunk)).astype(np.float32)))
+        if len(self._samples) < win_length:
+            return ''
+        n_frames = (len(self._samples) - win_length) // hop_length + 1
+        used = (n_frames - 1) * hop_length + win_length
+        _, _, stft = scipy.signal.stft(self._samples[:used], self.sr, window='hann', nperseg=win_length,
+                                       noverlap=win_length-hop_length, nfft=n_fft, boundary=None, padded=False)
+        self._samples = self._samples[n_frames * hop_length:]
+        # single precision dB as in get_dft, still relative to 1: the reference is the strongest power of the stream
+        power = get_power(stft)
+        self._power_max = np.max(power) if self._power_max is None else max(self._power_max, np.max(power))
+        return self.feed_spectrogram(power_to_db(power, 1.0))
+
+    def feed_spectrogram(self, dft):
+        # dft: dB frames of shape (bins, frames), e.g. a slice of get_dft output
+        if dft.shape[1] == 0:
+            return ''
+        self._db_max = max(self._db_max, np.max(dft))
+        self._db_min = max(min(self._db_min, np.min(dft)), self._db_max - TOP_DB)
+        self._raw_min = np.min(dft) if self._raw_min is None else min(self._raw_min, np.min(dft))
+        self._raw_max = np.max(dft) if self._raw_max is None else max(self._raw_max, np.max(dft))
+
+        past_mean = None
+        if self._carrier_sum is not None or self.carrier_bin is None:
+            chunk_sum = np.sum(np.maximum(dft, self._db_max - TOP_DB), axis=1)
+            chunk_peak = np.max(dft, axis=1)
+            if self._carrier_sum is None:
+                self._carrier_sum, self._carrier_peak = chunk_sum, chunk_peak
+            else:
+                past_mean = self._carrier_sum / self._carrier_count
+                self._carrier_sum = self._carrier_sum + chunk_sum
+                self._carrier_peak = np.maximum(self._carrier_peak, chunk_peak)
+            self._carrier_count += dft.shape[1]
+
+        if self.carrier_bin is None:
+            # find the dominant frequency over the first frames, then decode what has been buffered so far
+            self._pending_frames.append(dft)
+            if self._carrier_count < self.carrier_frames:
+                return ''
+            return self._lock_carrier()
+        emitted = ''
+        if self._carrier_sum is not None:
+            self._set_candidates(past_mean)
+            emitted += self._follow_carrier()
+        return emitted + self._feed_frames(dft)
+
+    def _feed_frames(self, dft):
+        self._frame_count += dft.shape[1]
+        for freq_bin, row in zip(self._candidate_bins.tolist(), dft[self._candidate_bins]):
+            kept = self._rows[freq_bin]
+            kept[2].append(row)
+            # bounded for endless streams, whole chunks are dropped
+            while not self.keep_rows and self._frame_count - kept[0] - len(kept[2][0]) >= HISTORY_FRAMES:
+                kept[0] += len(kept[2].pop(0))
+        return self._feed_envelope(dft[self.carrier_bin])
+
+    def _lock_carrier(self):
+        # the live decoder follows the strongest bin so far, the final solve picks among the strongest few
+        self.carrier_bin = int(np.argmax(self._carrier_sum))
+        self._set_candidates()
+        dft = np.concatenate(self._pending_frames, axis=1)
+        self._pending_frames = []
+        return self._feed_frames(dft)
+
+    def _set_candidates(self, past_mean=None):
+        # the strongest bins by their mean, which the final solve picks from, and by their peak, so that a carrier that
+        # starts late is kept from its first marks on. a bin that becomes a candidate gets its mean over the frames it
+        # missed: its mean over the stream stays right for the final pick, only its keying in them is lost
+        by_mean = np.argsort(self._carrier_sum, kind='stable')[::-1][:self.candidates]
+        by_peak = np.argsort(self._carrier_peak, kind='stable')[::-1][:self.candidates]
+        self._candidate_bins = np.union1d(by_mean, by_peak)
+        self._rows = {freq_bin: self._rows.get(freq_bin) or
+                      [self._frame_count, 0.0 if past_mean is None else past_mean[freq_bin], []]
+                      for freq_bin in self._candidate_bins.tolist()}
+
+    def _follow_carrier(self):
+        # re-lock onto a bin that has clearly overtaken the carrier, e.g. when the stream starts with noise
+        best = int(np.argmax(self._carrier_sum))
+        if (self._carrier_sum[best] - self._carrier_sum[self.carrier_bin]) / self._carrier_count < RELOCK_DB:
+            return ''
+        self.carrier_bin = best
+        # what was decoded so far came from another bin: its edges and timings are dropped, the new carrier is decoded
+        # again from when it became a candidate, and starts a new word
+        self._level, self._run = None, 0
+        self._seen_on = self._spaced = False
+        self._events = []
+        self._symbol_centers = self._spacing_centers = None
+        self._letter = ''
+        self._separator = '/'
+        chunks = self._rows[best][2]
+        return self._feed_envelope(np.concatenate(chunks)) if chunks else ''
+
+    def flush(self):
+        # end of stream: process the zero padded tail, close the current letter and, with keep_rows, solve the whole
+        # stream
+        emitted = ''
+        if self._fed_audio:
+            win_length = int(self.values['win_length'])
+            hop_length = int(self.values['hop_length'])
+            extended = len(self._samples) + win_length // 2
+            emitted += self.feed_audio(np.zeros(win_length // 2 + (-(extended - win_length) % hop_length) % win_length))
+            self._fed_audio = False
+        if self.carrier_bin is None and self._pending_frames:
+            emitted += self._lock_carrier()
+        if self._level == 1:
+            self._seen_on = True
+            self._events.append((1, self._run))
+        self._level, self._run = None, 0
+        # without a single spacing solve gives nothing, so a lone letter is dropped
+        if self._spaced:
+            if self._symbol_centers is None:
+                self._init_timing()
+            emitted += self._drain_events()
+            emitted += self._end_letter()
+        if self.keep_rows:
+            self._final_code, self.status = self._solve()
+        return emitted
+
+    def _solve(self):
+        # the steps of get_dft and solve on the whole stream: dB relative to the strongest power, floored TOP_DB below
+        # the maximum, the dominant row mapped to [0, 1] between the minimum and the maximum, then solve_envelope
+        if not self._frame_count:
+            return '', ''
+        kept = (self._rows[freq_bin] for freq_bin in self._candidate_bins.tolist())
+        rows = np.array([np.concatenate([np.full(missed, fill, dtype=chunks[0].dtype)] + chunks)
+                         for missed, fill, chunks in kept])
+        ref = 0 if self._power_max is None else 10.0 * np.log10(max(AMIN, self._power_max))
+        rows = rows - ref
+        top = self._raw_max - ref
+        floor = top - TOP_DB
+        np.maximum(rows, floor, out=rows)
+        value_range = [max(self._raw_min - ref, floor), top]
+        best = int(np.argmax(np.mean(rows, axis=1)))
+        status = []
+        envelope = dominant_envelope(rows[best:best + 1], self.sr, self.values, int(self._candidate_bins[best]),
+                                     value_range, status=status)
+        return solve_envelope(envelope, self.sr, self.values, status)
+
+    # ---------------------------------------------------- Edges ---------------------------------------------------- #
+
+    def _feed_envelope(self, row):
+        lo, hi = self._db_min, self._db_max
+        if hi > lo:
+            binary = np.where((row - lo) / (hi - lo) > 0.85, 1, 0)  # 0.85 is the threshold, same as solve
+        else:
+            binary = np.zeros(len(row), dtype=int)
+        if self._level is None:
+            self._level = binary[0]
+            self._run = 0
+
+        # run lengths of this chunk, the first one continues the run carried over from the previous chunk
+        change_idx = np.flatnonzero(np.diff(binary)) + 1
+        starts = np.concatenate(([0], change_idx))
+        lengths = np.diff(np.concatenate((starts, [len(binary)])))
+        levels = binary[starts]
+
+        emitted = ''
+        for level, length in zip(levels, lengths):
+            if level == self._level:
+                self._run += length
+                continue
+            emitted += self._end_run()
+            self._level, self._run = level, length
+        emitted += self._watch_gap()
+        return emitted
+
+    def _end_run(self):
+        # leading silence is not a spacing, mirroring how solve drops everything before the first rising edge
+        if self._level == 1:
+            self._seen_on = True
+            self._events.append((1, self._run))
+        elif self._seen_on:
+            self._spaced = True
+            self._events.append((0, self._run))
+        if self._symbol_centers is None:
+            if sum(kind == 1 for kind, _ in self._events) < self.warmup_symbols:
+                return ''
+            self._init_timing()
+        return self._drain_events()
+
+    # ---------------------------------------------------- Timing --------------------------------------------------- #
+
+    def _init_timing(self):
+        on = np.array([length for kind, length in self._events if kind == 1], dtype=float)
+        off = np.array([length for kind, length in self._events if kind == 0], dtype=float)
+        self._symbol_centers = _lloyd_1d(on, np.array([on.min(), on.max()]))
+        if self._symbol_centers[1] < 2 * self._symbol_centers[0]:
+            # only one kind of symbol seen yet, assume dots
+            self._symbol_centers = np.array([on.mean(), 3 * on.mean()])
+        dot, dash = self._symbol_centers
+        self._spacing_centers = _lloyd_1d(off, np.array([dot, dash, dash * 7 / 3]))
+
+    def _drain_events(self):
+        emitted = ''
+        for kind, length in self._events:
+            if kind == 1:
+                emitted += self._start_letter()
+                label = self._classify(self._symbol_centers, length)
+                self._letter += '.' if label == 0 else '-'
+            else:
+                label = self._classify(self._spacing_centers, length)
+                if label > 0:
+                    emitted += self._end_letter()
+                if label > 1:
+                    self._separator = '/'
+        self._events = []
+        return emitted
+
+    def _classify(self, centers, length):
+        label = int(np.argmin(np.abs(centers - length)))
+        centers[label] += self.learning_rate * (length - centers[label])
+        centers.sort()
+        return label
+
+    def _watch_gap(self):
+        # emit the current letter as soon as the ongoing silence is longer than a symbol spacing
+        if self._level != 0 or self._spacing_centers is None or not self._letter:
+            return ''
+        if self._run > np.mean(self._spacing_centers[:2]):
+            return self._end_letter()
+        return ''
+
+    def _start_letter(self):
+        if self._letter or not self._letters:
+            return ''
+        emitted = self._separator
+        self.live_code += emitted
+        self._separator = ''
+        return emitted
+
+    def _end_letter(self):
+        if not self._letter:
+            return ''
+        emitted = self._letter
+        self.live_code += emitted
+        self._letter = ''
+        self._letters += 1
+        self._separator = ' '
+        return emitted
+
+
+def _lloyd_1d(x, centers, n_iter=20):
+    # deterministic 1-d k-means from the given starting centers, empty clusters keep their starting value
+    centers = centers.astype(float)
+    if len(x) == 0:
+        return centers
+    for _ in range(n_iter):
+        labels = np.argmin(np.abs(x[:, None] - centers[None, :]), axis=1)
+        for k in range(len(centers)):
+            if np.any(labels == k):
+                centers[k] = x[labels == k].mean()
+    return np.sort(centers)
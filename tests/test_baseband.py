@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+
+
+def tone(freq, sr, seconds=2.0):
+    return np.sin(2 * np.pi * freq * np.arange(int(seconds * sr)) / sr).astype(np.float32)
+
+
+def test_wide_band_is_left_alone():
+    # 2.5 times the band does not fit in a smaller sample rate, there is nothing to decimate
+    y = tone(1000, 8000)
+    out, sr, values = morse.to_baseband(y, 8000, DEFAULTS, band=(500, 3000))
+    assert out is y and sr == 8000 and values is DEFAULTS
+
+
+@pytest.mark.parametrize('band', [(500, 3000), (900, 1100), (600, 1400)])
+def test_tone_keeps_its_frequency(band):
+    y = tone(1000, 8000)
+    out, sr, values = morse.to_baseband(y, 8000, DEFAULTS, band=band)
+    # the tone, and nothing else, stands out of the spectrum
+    carrier, confidence = morse.estimate_carrier(out, sr, values)
+    assert abs(carrier - 1000) < 5
+    assert confidence > 0.99
+    spectrum = np.mean(morse.get_dft(out, sr, values), axis=1)
+    freqs = morse.bin_to_freq(np.arange(len(spectrum)), sr, values)
+    assert np.max(spectrum[np.abs(freqs - 1000) > 50]) < np.max(spectrum) - 40
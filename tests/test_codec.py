@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import codec  # noqa: E402
+import morse  # noqa: E402
+from config import MORSE  # noqa: E402
+
+# morse.decode is the string version codec has to match
+EDGE_CASES = ['', '   ', '.', '-', '... --- ...', '.... ../.-- --- .-. .-.. -..', ' .- ', '.-  -', '.-//-', '/', '//',
+              '.- / -', '........', '.-.-.-.-.-', 'x', '.x-', '.- é', '¿', '.-¿', '\t.-\n']
+
+
+def make_code(rng, n_letters):
+    # valid letters, the odd unknown one, and doubled separators that leave empty letters
+    letters = rng.choice(list(MORSE) + ['.........', '.-x', ''], size=n_letters)
+    separators = rng.choice([' ', ' ', ' ', '/', '  ', '//', ' / '], size=n_letters)
+    return ''.join(np.char.add(letters, separators))
+
+
+@pytest.mark.parametrize('code', EDGE_CASES)
+def test_decode_edge_cases(code):
+    assert codec.decode(code) == morse.decode(code)
+
+
+def test_decode_random():
+    rng = np.random.RandomState(0)
+    for _ in range(2000):
+        code = make_code(rng, rng.randint(1, 30))
+        assert codec.decode(code) == morse.decode(code), code
+
+
+def test_decode_many():
+    rng = np.random.RandomState(1)
+    transcripts = EDGE_CASES + [make_code(rng, rng.randint(1, 30)) for _ in range(500)] + ['', ' ']
+    assert codec.decode_many(transcripts) == [morse.decode(code) for code in transcripts]
+    assert codec.decode_many([]) == []
+    assert codec.decode_many(['', '  ']) == ['', '']
+
+
+@pytest.mark.parametrize('text', ['SOS', 'HELLO, WORLD', 'CQ CQ DE K1ABC', '  LEADING  AND   TRAILING ', 'paris 73',
+                                  'A¿B', '¿', '', '   '])
+def test_encode_round_trip(text):
+    # characters that are not in MORSE are left out, and whitespace runs become one word spacing
+    kept = ' '.join(''.join(c for c in word if c in MORSE.values()) for word in text.upper().split())
+    kept = ' '.join(kept.split())
+    code = codec.encode(text)
+    assert code.count('/') == max(0, len(kept.split()) - 1)
+    assert codec.decode(code) == morse.decode(code) == (kept + ' ' if kept else '')
+
+
+def test_encode_random_round_trip():
+    rng = np.random.RandomState(2)
+    letters = sorted(MORSE.values())
+    for _ in range(500):
+        words = [''.join(rng.choice(letters, size=rng.randint(1, 8))) for _ in range(rng.randint(1, 6))]
+        text = ' '.join(words)
+        assert codec.decode(codec.encode(text)) == text + ' '
+
+
+def test_symbols_round_trip():
+    text = 'CQ CQ DE K1ABC'
+    symbol_labels, spacing_labels = codec.encode_symbols(text)
+    assert codec.decode_symbols(symbol_labels, spacing_labels) == text + ' '
+    assert codec.encode_code(symbol_labels, spacing_labels) == codec.encode(text)
+    assert codec.decode_symbols([], []) == ''
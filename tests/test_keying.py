@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import autotune  # noqa: E402
+import codec  # noqa: E402
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+from util import frames_to_time  # noqa: E402
+
+PERFECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'perfect.wav')
+
+
+def test_time_band_keeps_file_times():
+    y, sr = morse.load_file(PERFECT)
+    dft = morse.get_dft(y, sr, DEFAULTS)
+    values = dict(DEFAULTS, apply_time_band=True, time_band_min='0.5')
+    pipeline = morse.FilterPipeline(dft, sr, DEFAULTS)
+    pipeline.apply(values)
+
+    keying, _ = pipeline.solve(values, events=True)
+    expected, _ = morse.solve(morse.tweak_dft(dft, sr, values), sr, values, events=True)
+    assert keying.code == expected.code != ''
+    assert np.array_equal(keying.events, expected.events)
+    assert np.array_equal(keying.transcript, expected.transcript)
+    assert keying.transcript['start'][0] > 0.5
+
+
+def test_time_band_keeps_segment_times():
+    y, sr = morse.load_file(PERFECT)
+    dft = morse.get_dft(y, sr, DEFAULTS)
+    values = dict(DEFAULTS, apply_time_band=True, time_band_min='0.5')
+    pipeline = morse.FilterPipeline(dft, sr, DEFAULTS)
+    pipeline.apply(values)
+
+    _, _, segments = pipeline.solve_segments(values)
+    _, _, expected = morse.solve_segments(morse.tweak_dft(dft, sr, values), sr, values)
+    # the first transmission starts where the time band does, not at 0
+    (time_min, _), _ = pipeline.get_bands()
+    assert time_min > 0
+    assert segments[0]['start'] == frames_to_time(time_min, sr, DEFAULTS)
+    assert segments[-1]['end'] == expected[-1]['end']
+
+
+def test_exact_timings_score_as_exact():
+    # 'PARIS' keyed at exactly 1:3 and 1:3:7, 4 frames per unit
+    text = 'PARIS PARIS'
+    symbol_labels, spacing_labels = codec.encode_symbols(text)
+    units = np.concatenate((np.where(symbol_labels == codec.DASH, 3, 1)[:, None],
+                            np.append(np.array([1, 3, 7])[spacing_labels], 7)[:, None]), axis=1).ravel()
+    envelope = np.repeat(np.tile([1.0, 0.0], len(units) // 2), 4 * units)
+    stats = {}
+    code, _ = morse.solve_envelope(envelope, 44100, DEFAULTS, stats=stats)
+    assert morse.decode(code) == text + ' '
+    assert stats['dash_frames'] / stats['dot_frames'] == 3
+    assert stats['word_spacing_frames'] / stats['symbol_spacing_frames'] == 7
+    assert autotune.score(code, stats) == 10 / 13
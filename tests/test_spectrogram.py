@@ -0,0 +1,35 @@
+import glob
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+
+EXAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', '*.wav')))
+
+
+@pytest.mark.parametrize('filename', EXAMPLES, ids=os.path.basename)
+def test_chunked_matches_get_dft(filename, tmp_path):
+    expected = morse.get_dft(*morse.load_file(filename), DEFAULTS)
+    out = np.memmap(tmp_path / 'dft.f32', dtype=np.float32, mode='w+', shape=expected.shape)
+    dft, _ = morse.get_dft_chunked(filename, DEFAULTS, block_frames=100, out=out)
+    assert dft is out
+    assert np.array_equal(dft, expected)
+    del dft, out
+
+
+@pytest.mark.parametrize('filename', EXAMPLES, ids=os.path.basename)
+def test_parallel_matches_sequential(filename):
+    y, sr = morse.load_file(filename)
+    expected = morse.get_dft(y, sr, DEFAULTS, processes=1)
+    # small blocks, so the frames are split between the workers in many pieces
+    dft = morse.get_dft(y, sr, DEFAULTS, block_frames=100, processes=2)
+    assert dft.dtype == expected.dtype
+    assert np.array_equal(dft, expected)
+    assert np.array_equal(morse.get_dft(y, sr, DEFAULTS, quantize=True, block_frames=100, processes=2),
+                          morse.get_dft(y, sr, DEFAULTS, quantize=True))
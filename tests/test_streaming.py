@@ -0,0 +1,89 @@
+import glob
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import morse  # noqa: E402
+from config import DEFAULTS  # noqa: E402
+from streaming import HISTORY_FRAMES, StreamingDecoder  # noqa: E402
+
+EXAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', '*.wav')))
+CHUNK_SIZES = (1000, 4096, 44100, None)  # None: the whole file at once
+
+
+@pytest.fixture(scope='module', params=EXAMPLES, ids=os.path.basename)
+def example(request):
+    y, sr = morse.load_file(request.param)
+    return y, sr, morse.get_dft(y, sr, DEFAULTS)
+
+
+@pytest.mark.parametrize('chunk', CHUNK_SIZES)
+def test_audio_matches_solve(example, chunk):
+    y, sr, dft = example
+    decoder = StreamingDecoder(sr, DEFAULTS)
+    chunk = chunk or len(y)
+    for start in range(0, len(y), chunk):
+        decoder.feed_audio(y[start:start + chunk])
+    decoder.flush()
+    assert (decoder.code, decoder.status) == morse.solve(dft, sr, DEFAULTS)
+
+
+@pytest.mark.parametrize('frames', (7, 256, None))
+def test_spectrogram_matches_solve(example, frames):
+    _, sr, dft = example
+    decoder = StreamingDecoder(sr, DEFAULTS)
+    frames = frames or dft.shape[1]
+    for start in range(0, dft.shape[1], frames):
+        decoder.feed_spectrogram(dft[:, start:start + frames])
+    decoder.flush()
+    assert (decoder.code, decoder.status) == morse.solve(dft, sr, DEFAULTS)
+
+
+def test_given_carrier_matches_solve(example):
+    y, sr, dft = example
+    carrier, _ = morse.estimate_carrier(y, sr, DEFAULTS)
+    decoder = StreamingDecoder(sr, DEFAULTS, carrier)
+    for start in range(0, len(y), 4096):
+        decoder.feed_audio(y[start:start + 4096])
+    decoder.flush()
+    assert decoder.code == morse.solve(dft, sr, DEFAULTS, carrier=carrier)[0]
+
+
+def test_no_spacing_emits_nothing():
+    sr = 8000
+    y = np.zeros(sr)
+    y[2000:3000] = np.sin(2 * np.pi * 700 * np.arange(1000) / sr)
+    decoder = StreamingDecoder(sr, DEFAULTS)
+    emitted = decoder.feed_audio(y) + decoder.flush()
+    assert emitted == decoder.live_code == decoder.code == ''
+
+
+@pytest.mark.parametrize('level', (0.0, 0.1))
+def test_leading_noise_relocks(level):
+    # the first frames hold noise only (or silence), the carrier comes in later
+    y, sr = morse.load_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'perfect.wav'))
+    y = np.concatenate((level * np.random.RandomState(0).randn(3 * sr), y))
+    decoder = StreamingDecoder(sr, DEFAULTS)
+    for start in range(0, len(y), 4096):
+        decoder.feed_audio(y[start:start + 4096])
+    decoder.flush()
+    code, status = morse.solve(morse.get_dft(y, sr, DEFAULTS), sr, DEFAULTS)
+    assert (decoder.code, decoder.status) == (code, status)
+    assert decoder.live_code.endswith(code.strip(' /').split('/')[-1])
+
+
+def test_without_rows_memory_is_bounded():
+    y, sr = morse.load_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'perfect.wav'))
+    y = np.tile(y, 6)
+    decoder = StreamingDecoder(sr, DEFAULTS, keep_rows=False)
+    for start in range(0, len(y), 4096):
+        decoder.feed_audio(y[start:start + 4096])
+    decoder.flush()
+    assert decoder._frame_count > HISTORY_FRAMES
+    assert max(sum(len(chunk) for chunk in chunks) for _, _, chunks in decoder._rows.values()) < HISTORY_FRAMES + 64
+    assert decoder.code == decoder.live_code
+    assert decoder.text.count('HELLO, WORLD') >= 5
@@ -29,12 +29,17 @@ def time_to_frames(t, sr, values):
     return samples_to_frames(samples, values)
 
 
+def get_base_freq(values):
+    # the frequency that 0 Hz of the signal stands for, not zero once morse.to_baseband has shifted it down
+    return float(values.get('base_freq') or 0)
+
+
 def fft_frequencies(sr, values):
-    return np.fft.rfftfreq(n=int(values['n_fft']), d=1.0 / sr)
+    return np.fft.rfftfreq(n=int(values['n_fft']), d=1.0 / sr) + get_base_freq(values)
 
 
 def freq_to_bin(f, sr, values):
-    return int(f / get_bin_size(sr, values))
+    return int((f - get_base_freq(values)) / get_bin_size(sr, values))
 
 
 def get_bin_size(sr, values):
@@ -42,7 +47,7 @@ def get_bin_size(sr, values):
 
 
 def bin_to_freq(f, sr, values):
-    return f * get_bin_size(sr, values)
+    return f * get_bin_size(sr, values) + get_base_freq(values)
 
 
 def get_domains(shape, sr, boundaries, values):